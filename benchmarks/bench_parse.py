@@ -0,0 +1,204 @@
+"""
+Parsing benchmark on a synthetic invoice corpus.
+
+Measures throughput, latency of each parsing stage and peak RSS of the parsers for a
+range of corpus sizes, each run in a fresh interpreter so that memory is not shared
+between runs. The extracted rows are compared to the values the invoices were generated
+from. Results are written as JSON, tagged with the energylens version, for tracking
+regressions between versions.
+
+    $ uv run python benchmarks/bench_parse.py --sizes 10 100 1000 --parsers pypdf docling --output bench.json
+    $ uv run python benchmarks/bench_parse.py --sizes 100 --parsers docling docling-fast
+"""
+
+import argparse
+import functools
+import json
+import math
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+from datetime import datetime, timezone
+from pathlib import Path
+
+from corpus import EXPECTED_NAME, generate_corpus
+
+PARSERS = ("pypdf", "pypdf-batch", "docling", "docling-fast")
+SIZES = (10, 100, 1000, 10000)
+
+
+class Stages:
+    """Latencies of the named stages of parsing."""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+
+    def run(self, name: str, func: Callable, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+        return result
+
+    def summary(self) -> dict:
+        return {
+            name: {
+                "count": len(values),
+                "mean_ms": round(statistics.fmean(values) * 1000, 3),
+                "p50_ms": round(statistics.median(values) * 1000, 3),
+                "p95_ms": round(sorted(values)[math.ceil(len(values) * 0.95) - 1] * 1000, 3),
+                "max_ms": round(max(values) * 1000, 3),
+            }
+            for name, values in self.latencies.items()
+        }
+
+
+def _parse_pypdf(pdf_paths: list[Path], stages: Stages) -> list[dict]:
+    from energylens.pypdf_parser import _pdf_to_text, _texts_to_pl
+
+    rows = []
+    for pdf_path in pdf_paths:
+        text_pages = stages.run("text", _pdf_to_text, pdf_path)
+        rows.append(stages.run("extract", _texts_to_pl, text_pages).row(0, named=True))
+    return rows
+
+
+def _parse_pypdf_batch(pdf_paths: list[Path], stages: Stages) -> list[dict]:
+    from energylens.pypdf_parser import _pdf_to_text, batch_texts_to_pl
+
+    texts = [" ".join(stages.run("text", _pdf_to_text, pdf_path)) for pdf_path in pdf_paths]
+    return stages.run("extract_batch", batch_texts_to_pl, texts).rows(named=True)
+
+
+def _parse_docling(pdf_paths: list[Path], stages: Stages, preset: str = "default") -> list[dict]:
+    from energylens.docling_parser import convert_pdf_to_document, get_converter, parse_document_to_pl_using_docling
+    from energylens.types import DoclingProfile
+
+    profile = DoclingProfile.preset(preset)
+    stages.run("load", get_converter, profile)
+    rows = []
+    for pdf_path in pdf_paths:
+        try:
+            doc = stages.run("convert", convert_pdf_to_document, pdf_path, profile)
+            rows.append(stages.run("extract", parse_document_to_pl_using_docling, doc).row(0, named=True))
+        except (KeyError, IndexError):
+            rows.append({})
+    return rows
+
+
+_PARSE_FUNCTIONS = {
+    "pypdf": _parse_pypdf,
+    "pypdf-batch": _parse_pypdf_batch,
+    "docling": _parse_docling,
+    # No OCR, to compare time and accuracy with the Docling defaults on the same corpus
+    "docling-fast": functools.partial(_parse_docling, preset="fast"),
+}
+
+
+def _matches(expected, value) -> bool:
+    if isinstance(expected, float):
+        return isinstance(value, float) and abs(expected - value) < 0.006
+    return expected == value
+
+
+def accuracy(expected: list[dict], rows: list[dict]) -> dict:
+    """Share of the generated values found in the parsed rows, in total and per column."""
+    columns = {}
+    for values, row in zip(expected, rows):
+        for column, value in values.items():
+            if column in ("filename", "layout") or value is None:
+                continue
+            columns.setdefault(column, []).append(_matches(value, row.get(column)))
+    matched = [m for column_matches in columns.values() for m in column_matches]
+    return {
+        "total": round(sum(matched) / len(matched), 4) if matched else None,
+        "columns": {column: round(sum(m) / len(m), 4) for column, m in columns.items()},
+    }
+
+
+def run_one(parser: str, size: int, corpus: Path) -> dict:
+    """Parse the first size invoices of the corpus, run within its own interpreter."""
+    from energylens import __version__
+
+    expected = json.loads((corpus / EXPECTED_NAME).read_text(encoding="utf-8"))[:size]
+    pdf_paths = [corpus / values["filename"] for values in expected]
+    stages = Stages()
+    start = time.perf_counter()
+    rows = _PARSE_FUNCTIONS[parser](pdf_paths, stages)
+    elapsed = time.perf_counter() - start
+    return {
+        "parser": parser,
+        "size": size,
+        "version": __version__,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_per_s": round(size / elapsed, 2),
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10), 1
+        ),
+        "stages": stages.summary(),
+        "accuracy": accuracy(expected, rows),
+    }
+
+
+def ensure_corpus(corpus: Path, size: int, seed: int) -> None:
+    """Generate the corpus unless one of at least the size and seed exists."""
+    info_path = corpus / "corpus.json"
+    if info_path.exists():
+        info = json.loads(info_path.read_text())
+        if info["size"] >= size and info["seed"] == seed:
+            return
+    generate_corpus(corpus, size, seed)
+    info_path.write_text(json.dumps({"size": size, "seed": seed}))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Corpus sizes to parse.")
+    parser.add_argument("--parsers", nargs="+", choices=PARSERS, default=("pypdf", "docling"), help="Parsers to run.")
+    parser.add_argument("--corpus", type=Path, default=Path("benchmarks/.corpus"), help="Folder of the corpus.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated corpus.")
+    parser.add_argument("--output", type=Path, help="File to write the results to, default stdout.")
+    parser.add_argument("--run-one", nargs=2, metavar=("PARSER", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(args.run_one[0], int(args.run_one[1]), args.corpus)))
+        return 0
+
+    ensure_corpus(args.corpus, max(args.sizes), args.seed)
+    results = []
+    for parser_name in args.parsers:
+        for size in sorted(args.sizes):
+            output = subprocess.run(
+                [sys.executable, __file__, "--corpus", args.corpus.as_posix(), "--run-one", parser_name, str(size)],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(output.splitlines()[-1])
+            print(
+                f"{parser_name:12} {size:>6} invoices {result['throughput_per_s']:>9.2f}/s "
+                f"peak RSS {result['peak_rss_mb']:>7.1f} MB accuracy {result['accuracy']['total']}",
+                file=sys.stderr,
+            )
+            results.append(result)
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "corpus_seed": args.seed,
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""
+Generator of a synthetic invoice PDF corpus for benchmarks.
+
+Real invoices contain personal data, so the corpus is made up of generated invoices laid
+out like the invoices of Jönköping Energi: an invoice heading with date and invoice number
+followed by ELNÄT, ELHANDEL, FJÄRRVÄRME and STADSNÄT tables. Cells are placed as on the
+real invoices, including the order of the content stream that makes the text layer run
+cells together (e.g. "523,0025,60" and "kr/år krFast Avgift") as the pypdf/regex rules expect.
+The old layout has all tables on one page, the new one a summary page in front of the tables
+and slightly different row labels. The values of each invoice are written to expected.json.
+
+    $ uv run python benchmarks/corpus.py --size 100 --output /tmp/energylens-corpus
+"""
+
+import argparse
+import dataclasses
+import json
+import random
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+LAYOUTS = ("old", "new")
+EXPECTED_NAME = "expected.json"
+
+# Helvetica glyph widths (1/1000 em) of the characters used in numbers
+_NUMBER_WIDTHS = {",": 278, " ": 278, "-": 333} | {d: 556 for d in "0123456789"}
+# Column positions of the tables: label, Antal, Pris, Enhet, Summa, currency
+_COLUMNS = (50, 300, 300, 390, 500, 540)
+_FONT_SIZE = 9
+_LINE_HEIGHT = 13
+
+
+@dataclasses.dataclass(frozen=True)
+class Cell:
+    """Text placed at x, or right aligned to end at x, in the order cells are written."""
+
+    x: float
+    text: str
+    right_aligned: bool = False
+
+
+@dataclasses.dataclass
+class Page:
+    lines: list[tuple[float, list[Cell], str]] = dataclasses.field(default_factory=list)
+    rules: list[float] = dataclasses.field(default_factory=list)
+    y: float = 790
+
+    def text(self, *cells: Cell, font: str = "F1") -> None:
+        self.lines.append((self.y, list(cells), font))
+        self.y -= _LINE_HEIGHT
+
+    def heading(self, text: str) -> None:
+        self.y -= 6
+        self.lines.append((self.y, [Cell(_COLUMNS[0], text)], "F2"))
+        self.y -= _LINE_HEIGHT + 4
+
+    def rule(self) -> None:
+        self.rules.append(self.y + _LINE_HEIGHT - 3)
+
+
+def _kr(value: float, grouping: bool = True) -> str:
+    """Swedish number format, e.g. 1 234,56, quantities are written without grouping."""
+    return f"{value:{',' if grouping else ''}.2f}".replace(",", " ").replace(".", ",")
+
+
+def _width(text: str) -> float:
+    return sum(_NUMBER_WIDTHS.get(c, 556) for c in text) * _FONT_SIZE / 1000
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def render_pdf(pages: list[Page]) -> bytes:
+    """Write pages as a minimal PDF using the standard Helvetica fonts."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b""]
+    fonts = b"<< /F1 3 0 R /F2 4 0 R >>"
+    objects += [
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+    ]
+    kids = []
+    for page in pages:
+        ops = ["0.5 w"] + [f"50 {y:.1f} m 545 {y:.1f} l S" for y in page.rules] + ["BT"]
+        for y, cells, font in page.lines:
+            ops.append(f"/{font} {_FONT_SIZE if font == 'F1' else 14} Tf")
+            for cell in cells:
+                x = cell.x - _width(cell.text) if cell.right_aligned else cell.x
+                ops.append(f"1 0 0 1 {x:.2f} {y:.1f} Tm ({_escape(cell.text)}) Tj")
+        ops.append("ET")
+        content = "\n".join(ops).encode("cp1252")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        kids.append(len(objects) + 1)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font %s >> /Contents %d 0 R >>"
+            % (fonts, len(objects))
+        )
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids),
+        len(kids),
+    )
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for idx, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % idx + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer << /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _table_header(page: Page) -> None:
+    label, antal, pris, enhet, summa, _ = _COLUMNS
+    page.text(
+        Cell(antal, "Antal", right_aligned=True), Cell(pris + 10, "Pris"), Cell(enhet, "Enhet"),
+        Cell(summa, "Summa", right_aligned=True),
+    )
+    page.rule()
+
+
+def _item(page: Page, text: str, antal: str | None, pris: str, enhet: str, summa: str) -> None:
+    """Table row, Antal is right aligned against Pris which runs them together in the text layer."""
+    label, antal_x, pris_x, enhet_x, summa_x, _ = _COLUMNS
+    cells = [Cell(label, text)]
+    if antal is not None:
+        cells.append(Cell(antal_x, antal, right_aligned=True))
+    cells += [Cell(pris_x, pris), Cell(enhet_x, enhet), Cell(summa_x, summa, right_aligned=True)]
+    page.text(*cells)
+
+
+def _total(page: Page, text: str, amount: str) -> None:
+    page.rule()
+    page.text(Cell(_COLUMNS[0], text), Cell(_COLUMNS[4], amount, right_aligned=True), Cell(_COLUMNS[5], "kr"))
+    page.y -= 8
+
+
+def _two_line_item(page: Page, text: str, units: tuple[str, ...], amounts: tuple[str, str], summa: str) -> None:
+    """
+    District heating row, units on a line of their own above the amounts.
+
+    The units are written before the label, the label further left is then run together
+    with them, as is the sum with the Antal and Pris of the next line.
+    """
+    label, antal_x, pris_x, enhet_x, summa_x, _ = _COLUMNS
+    antal, pris = amounts
+    unit_cells = [Cell(x, unit) for x, unit in zip((antal_x - 45, antal_x - 15, pris_x + 10, summa_x - 10), units)]
+    page.text(*unit_cells, Cell(label, text))
+    if text == "Energiavgift":
+        page.text(Cell(antal_x, antal, right_aligned=True), Cell(pris_x, pris), Cell(summa_x, summa, right_aligned=True))
+    else:
+        page.text(Cell(summa_x, summa, right_aligned=True), Cell(antal_x, antal, right_aligned=True), Cell(pris_x, pris))
+
+
+def random_invoice(rng: random.Random, idx: int, layout: str) -> dict:
+    """Values of a made up invoice, totals are excluding VAT."""
+    invoice_date = date(2019, 1, 5) + timedelta(days=30 * idx % 3650 + rng.randrange(5))
+    kwh = rng.randrange(150, 900)
+    values = {
+        "date": invoice_date.isoformat(),
+        "invoice_number": str(4_000_000 + idx),
+        "El förbrukning (kWh)": float(kwh),
+        "Elnät fast avgift enkeltariff (kr/mån)": round(rng.uniform(150, 250), 2),
+        "Elnät överföring enkeltariff (öre/kWh)": round(rng.uniform(15, 30), 2),
+        "Elnät energiskatt (öre/kWh)": round(rng.uniform(35, 45), 2),
+        "Elhandel medelspotpris (öre/kWh)": round(rng.uniform(10, 250), 2),
+        "Elhandel rörliga kostnader (öre/kWh)": round(rng.uniform(2, 15), 2),
+        "Elhandel fasta påslag (öre/kWh)": round(rng.uniform(2, 8), 2),
+        "Elhandel fasta avgift (kr/mån)": round(rng.uniform(29, 59), 2),
+    }
+    elnat_items = values["Elnät fast avgift enkeltariff (kr/mån)"] + kwh * (
+        values["Elnät överföring enkeltariff (öre/kWh)"] + values["Elnät energiskatt (öre/kWh)"]
+    ) / 100
+    values["Elnät totalt belopp (kr)"] = round(elnat_items, 2)
+    elhandel_items = values["Elhandel fasta avgift (kr/mån)"] + kwh * (
+        values["Elhandel medelspotpris (öre/kWh)"]
+        + values["Elhandel rörliga kostnader (öre/kWh)"]
+        + values["Elhandel fasta påslag (öre/kWh)"]
+    ) / 100
+    values["Elhandel totalt belopp (kr)"] = round(elhandel_items, 2)
+    has_fjarrvarme = rng.random() < 0.7
+    mwh = round(rng.uniform(0.3, 2.5), 2)
+    fast_avgift = round(rng.uniform(3000, 6000), 2)
+    energiavgift = round(rng.uniform(450, 700), 2)
+    values |= {
+        "Fjärrvärme förbrukning (MWh)": mwh if has_fjarrvarme else None,
+        "Fjärrvärme fast avgift (kr/år)": fast_avgift if has_fjarrvarme else None,
+        "Fjärrvärme energiavgift (kr/MWh)": energiavgift if has_fjarrvarme else None,
+        "Fjärrvärme totalt belopp (kr)": (
+            round(fast_avgift / 12 + mwh * energiavgift, 2) if has_fjarrvarme else None
+        ),
+        "Stadsnät serviceavgift villa (kr/st)": round(rng.uniform(249, 399), 2) if rng.random() < 0.5 else None,
+    }
+    return values
+
+
+def layout_invoice(values: dict, layout: str) -> list[Page]:
+    """Lay out the values of an invoice in the old or new layout."""
+    new = layout == "new"
+    v = values
+    kwh = v["El förbrukning (kWh)"]
+    first = Page()
+    first.text(Cell(50, "Jönköping Energi AB"), Cell(400, "Box 5150"))
+    first.text(Cell(400, "551 05 Jönköping"))
+    first.heading(f"{v['date']} FAKTURA")
+    first.text(Cell(50, "Faktura-nr:"), Cell(160, v["invoice_number"]))
+    first.text(Cell(50, "Kundnummer:"), Cell(160, "123456"))
+    due = (date.fromisoformat(v["date"]) + timedelta(days=25)).isoformat()
+    first.text(Cell(50, "Förfallodag:"), Cell(160, due))
+    totals = {
+        "ELNÄT": v["Elnät totalt belopp (kr)"],
+        "ELHANDEL": v["Elhandel totalt belopp (kr)"],
+        "FJÄRRVÄRME": v["Fjärrvärme totalt belopp (kr)"],
+    }
+    if new:
+        first.y -= 10
+        first.text(Cell(50, "Sammanställning"))
+        for name, amount in totals.items():
+            if amount is not None:
+                first.text(Cell(50, f"{name} {_kr(amount)} kr"))
+        first.text(Cell(50, f"Att betala {_kr(sum(a for a in totals.values() if a is not None))} kr"))
+        page = Page()
+        pages = [first, page]
+    else:
+        page = first
+        pages = [first]
+
+    page.heading("ELNÄT")
+    page.text(Cell(50, "Anläggnings-id:"), Cell(160, "735999100000012345"))
+    page.text(Cell(50, "Förbrukning"), Cell(160, f"{int(kwh)} kWh"))
+    _table_header(page)
+    _item(page, "Fast avgift enkeltariff" if new else "Fast Avgift", None,
+          _kr(v["Elnät fast avgift enkeltariff (kr/mån)"]), "kr/mån", _kr(v["Elnät fast avgift enkeltariff (kr/mån)"]))
+    for text, column in (("Överföring enkeltariff" if new else "Överföring", "Elnät överföring enkeltariff (öre/kWh)"),
+                         ("Energiskatt", "Elnät energiskatt (öre/kWh)")):
+        _item(page, text, _kr(kwh, grouping=False), _kr(v[column]), "öre/kWh", _kr(kwh * v[column] / 100))
+    _total(page, "TOTALT BELOPP ELNÄT", _kr(v["Elnät totalt belopp (kr)"]))
+
+    page.heading("ELHANDEL")
+    fast_avgift = v["Elhandel fasta avgift (kr/mån)"]
+    if new:
+        page.text(Cell(50, "Elavtal: Rörligt pris med fast avgift"))
+    else:
+        page.text(Cell(50, "Elavtal: Rörligt pris"), Cell(250, f"{_kr(fast_avgift)} kr/mån"))
+    _table_header(page)
+    _item(page, "Fast avgift", _kr(1), _kr(fast_avgift), "kr/mån", _kr(fast_avgift))
+    for text, column in (
+        ("Medelspotpris", "Elhandel medelspotpris (öre/kWh)"),
+        ("Fasta påslag", "Elhandel fasta påslag (öre/kWh)"),
+        ("Rörliga kostnader Rörligt månadspris" if new else "Rörliga kostnader Elpris",
+         "Elhandel rörliga kostnader (öre/kWh)"),
+    ):
+        _item(page, text, _kr(kwh, grouping=False), _kr(v[column]), "öre/kWh", _kr(kwh * v[column] / 100))
+    _total(page, "TOTALT BELOPP ELHANDEL", _kr(v["Elhandel totalt belopp (kr)"]))
+
+    if v["Fjärrvärme totalt belopp (kr)"] is not None:
+        page.heading("FJÄRRVÄRME")
+        _table_header(page)
+        mwh, fast_avgift, energiavgift = (
+            v["Fjärrvärme förbrukning (MWh)"], v["Fjärrvärme fast avgift (kr/år)"], v["Fjärrvärme energiavgift (kr/MWh)"]
+        )
+        days = 31
+        _two_line_item(page, "Fast Avgift", (str(days), "dgr", "kr/år", "kr"), (_kr(days), _kr(fast_avgift)),
+                       _kr(fast_avgift * days / 365))
+        _two_line_item(page, "Energiavgift", (_kr(mwh), "MWh", "kr/MWh", "kr"), (_kr(mwh), _kr(energiavgift)),
+                       _kr(mwh * energiavgift))
+        _total(page, "TOTALT BELOPP FJÄRRVÄRME", _kr(v["Fjärrvärme totalt belopp (kr)"]))
+
+    if (serviceavgift := v["Stadsnät serviceavgift villa (kr/st)"]) is not None:
+        page.heading("STADSNÄT")
+        _table_header(page)
+        _item(page, "Serviceavgift Villa" if new else "Serviceavgift villa", _kr(1), _kr(serviceavgift), "kr/st",
+              _kr(serviceavgift))
+        _total(page, "TOTALT BELOPP STADSNÄT", _kr(serviceavgift))
+    return pages
+
+
+def generate_corpus(output: Path, size: int, seed: int = 0, filename_prefix: str = "invoice_") -> list[dict]:
+    """Write size invoices alternating between the layouts, returns and stores their expected values."""
+    output.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    expected = []
+    for idx in range(size):
+        layout = LAYOUTS[idx % len(LAYOUTS)]
+        values = random_invoice(rng, idx, layout)
+        filename = f"{filename_prefix}{idx:05d}.pdf"
+        (output / filename).write_bytes(render_pdf(layout_invoice(values, layout)))
+        expected.append({"filename": filename, "layout": layout} | values)
+    (output / EXPECTED_NAME).write_text(json.dumps(expected, ensure_ascii=False, indent=1), encoding="utf-8")
+    return expected
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=100, help="Number of invoices.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random values.")
+    parser.add_argument("--output", type=Path, required=True, help="Folder to write the invoices to.")
+    args = parser.parse_args()
+    generate_corpus(args.output, args.size, args.seed)
+    print(json.dumps({"output": args.output.as_posix(), "size": args.size, "seed": args.seed}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
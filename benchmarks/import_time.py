@@ -0,0 +1,67 @@
+"""
+Import-time benchmark enforcing the startup budget of the CLI.
+
+Each check imports a module in a fresh interpreter, measures the wall-clock time of
+the import and verifies that heavy dependencies not needed by it were not loaded.
+Exits with a non-zero status if a check exceeds the budget or loads forbidden modules.
+
+    $ uv run python benchmarks/import_time.py --budget 0.5
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ("docling", "torch", "pandas", "polars", "playwright", "numpy", "pypdf")
+
+# Module imported, and heavy modules it must not load
+CHECKS = {
+    "energylens": HEAVY_MODULES,
+    "energylens.cli": HEAVY_MODULES,
+    "energylens.scrape": tuple(m for m in HEAVY_MODULES if m != "playwright"),
+    "energylens.parse": ("docling", "torch", "pandas", "playwright"),
+}
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, forbidden: tuple[str, ...]) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(module=module, forbidden=forbidden)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--budget", type=float, default=0.5, help="Max seconds for importing energylens.cli.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs, the median is used.")
+    args = parser.parse_args()
+
+    results = []
+    for module, forbidden in CHECKS.items():
+        runs = [measure(module, forbidden) for _ in range(args.repeat)]
+        elapsed = statistics.median(run["elapsed"] for run in runs)
+        loaded = sorted({m for run in runs for m in run["loaded"]})
+        # Only the modules on the startup path of the CLI are held to the budget
+        over_budget = module in ("energylens", "energylens.cli") and elapsed > args.budget
+        results.append(
+            {"module": module, "elapsed": round(elapsed, 4), "forbidden_loaded": loaded, "ok": not (loaded or over_budget)}
+        )
+    print(json.dumps(results, indent=2))
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
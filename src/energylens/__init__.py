@@ -1,2 +1,17 @@
 from .__about__ import __version__
-from energylens.api import get_last_invoices, async_get_last_invoices
+
+
+def __getattr__(name: str):
+    # The API pulls in the scraping and parsing stack, import it only when used
+    if name in ("get_last_invoices", "async_get_last_invoices", "aiter_last_invoices"):
+        from energylens import api
+
+        return getattr(api, name)
+    if name == "invoice_report":
+        from energylens import report
+
+        return report.invoice_report
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["__version__", "get_last_invoices", "async_get_last_invoices", "aiter_last_invoices", "invoice_report"]
@@ -1,45 +1,224 @@
 import asyncio
+import multiprocessing
+from collections.abc import AsyncIterator, Iterable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
 import tempfile
 from pathlib import Path
+from typing import TYPE_CHECKING, Union
 
-from energylens.cli import download_invoices, parse_invoices
-from energylens.async_scrape import AsyncScraper
+import polars as pl
+
+from energylens.cli import download_invoices
 from energylens.log import logger
+from energylens.schema import OUTPUT_SCHEMA, PARQUET_OPTIONS, conform_to_schema
+from energylens.types import DoclingProfile, ResultFormat, Strategy
+
+if TYPE_CHECKING:
+    import pyarrow as pa
 
 Parquet = BytesIO
+ArrowIpc = BytesIO
+InvoiceResult = Union[pl.DataFrame, "pa.Table", ArrowIpc, Parquet]
+
+
+def _collect(invoice_dfs: Iterable[pl.DataFrame]) -> pl.DataFrame:
+    """Combine the rows of the invoices in memory, conformed to the output schema."""
+    invoice_dfs = [conform_to_schema(df) for df in invoice_dfs]
+    return pl.concat(invoice_dfs) if invoice_dfs else pl.DataFrame(schema=OUTPUT_SCHEMA)
+
+
+def _to_result(invoices_df: pl.DataFrame, result_format: ResultFormat) -> InvoiceResult:
+    """
+    Return the invoices in the requested form.
+
+    polars and arrow hand over the in-memory columns without encoding, arrow requires the
+    optional pyarrow dependency (the arrow extra). ipc is an uncompressed Arrow IPC stream of
+    record batches for passing to another process and parquet the compressed file format.
+    """
+    match result_format:
+        case "polars":
+            return invoices_df
+        case "arrow":
+            try:
+                return invoices_df.to_arrow()
+            except ModuleNotFoundError as e:
+                raise ModuleNotFoundError(
+                    "The arrow result format requires pyarrow, install energylens[arrow]"
+                ) from e
+        case "ipc":
+            file_object = BytesIO()
+            invoices_df.write_ipc_stream(file_object, compression="uncompressed")
+        case "parquet":
+            file_object = BytesIO()
+            invoices_df.write_parquet(file_object, **PARQUET_OPTIONS)
+    file_object.seek(0)
+    return file_object
 
 
-def get_last_invoices(count: int = 10, login_timeout: int = 30) -> Parquet:
-    """Convenience method to download and parse invoices."""
-    file_object = BytesIO()
+def get_last_invoices(
+    count: int = 10,
+    login_timeout: int = 30,
+    *,
+    result_format: ResultFormat = "polars",
+    strategy: Strategy = "docling",
+    docling: DoclingProfile = DoclingProfile(),
+    use_cache: bool = True,
+) -> InvoiceResult:
+    """
+    Convenience method to download and parse invoices, see `_to_result` for the result formats.
+
+    The Docling pipeline is configured by the profile, e.g. `DoclingProfile.preset("fast")`.
+    """
+    from energylens.cache import ParseCache
+    from energylens.parse import parse_invoice_files
+
     with tempfile.TemporaryDirectory() as tmpdirname:
-        outputfilename = Path(f"{tmpdirname}/tmp.parquet")
         logger.info(f"Downloading invoices to {tmpdirname}")
-        download_invoices(invoice_path=Path(tmpdirname), limit_invoices=count)
-        parse_invoices(Path(tmpdirname), output_file=outputfilename, output_format="parquet")
-        file_object.write(outputfilename.read_bytes())
-        return file_object
+        download_invoices(invoice_path=Path(tmpdirname), login_timout=login_timeout, limit_invoices=count)
+        cache = ParseCache(variant=f"{strategy}-{docling.key}") if use_cache else None
+        pdf_files = sorted(Path(tmpdirname).glob("invoice_*.pdf"), key=lambda x: x.name)
+        invoices_df = _collect(parse_invoice_files(pdf_files, cache, strategy=strategy, docling=docling))
+        if cache:
+            cache.report()
+    return _to_result(invoices_df, result_format)
+
+
+def _parse_executor(
+    workers: int, threads_per_worker: int, max_tasks_per_worker: int | None, strategy: Strategy, docling: DoclingProfile
+) -> Executor:
+    from energylens.parse import init_worker
+
+    if workers <= 1:
+        # A single thread keeps the event loop responsive and the Docling converter out of concurrent use
+        return ThreadPoolExecutor(max_workers=1)
+    # Forking the threads of the event loop and the browser is unsafe, workers start from a fresh interpreter
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(threads_per_worker, False, docling, strategy),
+        max_tasks_per_child=max_tasks_per_worker,
+    )
+
 
+async def _download_and_parse(
+    download_path: Path,
+    count: int,
+    login_timeout: int,
+    strategy: Strategy,
+    docling: DoclingProfile,
+    workers: int,
+    threads_per_worker: int,
+    max_tasks_per_worker: int | None,
+    use_cache: bool,
+) -> AsyncIterator[tuple[Path, pl.DataFrame]]:
+    """
+    Download invoices and parse each of them as soon as it is saved, yielding the rows as they are parsed.
 
-async def async_get_last_invoices(count: int = 10, login_timeout: int = 30) -> Parquet:
-    file_object = BytesIO()
+    Parsing runs in an executor, overlapping with the remaining downloads. Worker processes
+    are replaced after `max_tasks_per_worker` invoices to keep memory bounded.
+    """
+    from energylens.async_scrape import AsyncScraper
+    from energylens.cache import ParseCache, file_hash
+    from energylens.parse import parse_invoice
+
+    loop = asyncio.get_running_loop()
+    cache = ParseCache(variant=f"{strategy}-{docling.key}") if use_cache else None
+    # Invoices in download order with the key, whether the row is cached and the pending row
+    parsing: asyncio.Queue[tuple[Path, str, bool, asyncio.Future] | None] = asyncio.Queue()
+
+    with _parse_executor(workers, threads_per_worker, max_tasks_per_worker, strategy, docling) as executor:
+
+        def on_download(pdf_path: Path) -> None:
+            key = file_hash(pdf_path) if cache else ""
+            if cached := cache is not None and key in cache:
+                future = loop.create_future()
+                future.set_result(cache.get(key))
+            else:
+                future = loop.run_in_executor(executor, parse_invoice, pdf_path, strategy, docling)
+            parsing.put_nowait((pdf_path, key, cached, future))
+
+        async def download() -> None:
+            scraper = AsyncScraper(
+                download_path=download_path,
+                login_secs=login_timeout,
+                limit_invoices=count,
+                on_download=on_download,
+            )
+            try:
+                await scraper.async_init()
+                await scraper.download_invoices()
+                await scraper.close()
+            finally:
+                parsing.put_nowait(None)
+
+        downloading = asyncio.create_task(download())
+        try:
+            while (item := await parsing.get()) is not None:
+                pdf_path, key, cached, future = item
+                invoice_df = await future
+                if cache and not cached:
+                    cache.put(key, invoice_df)
+                logger.info(f"✅ Parsed {pdf_path.as_posix()}")
+                yield pdf_path, invoice_df
+            await downloading
+        finally:
+            downloading.cancel()
+            if cache:
+                cache.report()
+
+
+async def aiter_last_invoices(
+    count: int = 10,
+    login_timeout: int = 30,
+    *,
+    strategy: Strategy = "docling",
+    docling: DoclingProfile = DoclingProfile(),
+    workers: int = 1,
+    threads_per_worker: int = 1,
+    max_tasks_per_worker: int | None = 50,
+    use_cache: bool = True,
+) -> AsyncIterator[pl.DataFrame]:
+    """Download and parse invoices, yielding the row of each invoice as soon as it is parsed."""
     with tempfile.TemporaryDirectory() as tmpdirname:
         logger.info(f"Starting async download of invoices storing to {tmpdirname} ")
-        outputfilename = Path(f"{tmpdirname}/tmp.parquet")
-        logger.info(f"Downloading invoices to {tmpdirname}")
-        scraper = AsyncScraper(
-            download_path=Path(tmpdirname),
-            login_secs=login_timeout,
-            limit_invoices=count
-        )
-        await scraper.async_init()
-        await scraper.download_invoices()
-        await scraper.close()
-        logger.info(f"Parsing invoices in {tmpdirname}")
-        parse_invoices(Path(tmpdirname), output_file=outputfilename, output_format="parquet")
-        file_object.write(outputfilename.read_bytes())
-        return file_object
+        async for _, invoice_df in _download_and_parse(
+            Path(tmpdirname), count, login_timeout, strategy, docling,
+            workers, threads_per_worker, max_tasks_per_worker, use_cache,
+        ):
+            yield conform_to_schema(invoice_df)
+
+
+async def async_get_last_invoices(
+    count: int = 10,
+    login_timeout: int = 30,
+    *,
+    strategy: Strategy = "docling",
+    docling: DoclingProfile = DoclingProfile(),
+    workers: int = 1,
+    threads_per_worker: int = 1,
+    max_tasks_per_worker: int | None = 50,
+    use_cache: bool = True,
+    result_format: ResultFormat = "polars",
+) -> InvoiceResult:
+    """
+    Download and parse invoices, returning all rows, see `_to_result` for the result formats.
+
+    Invoices are parsed while the remaining ones are downloaded, the event loop is never blocked by parsing.
+    """
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        logger.info(f"Starting async download of invoices storing to {tmpdirname} ")
+        rows = [
+            item
+            async for item in _download_and_parse(
+                Path(tmpdirname), count, login_timeout, strategy, docling,
+                workers, threads_per_worker, max_tasks_per_worker, use_cache,
+            )
+        ]
+    # Same order as the output of parse_invoices
+    rows.sort(key=lambda item: item[0].name)
+    return _to_result(_collect(df for _, df in rows), result_format)
 
 
 def test_async_get_last_invoices():
@@ -47,4 +226,4 @@ def test_async_get_last_invoices():
 
 
 if __name__ == "__main__":
-    test_async_get_last_invoices()
\ No newline at end of file
+    test_async_get_last_invoices()
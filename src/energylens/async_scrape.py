@@ -1,11 +1,16 @@
 import asyncio
+from collections.abc import Callable
 from pathlib import Path
 
-from playwright.async_api import Playwright, expect, async_playwright
+from playwright.async_api import Browser, Error as PlaywrightError, Locator, Playwright, expect, async_playwright
 
 from .error import async_exception_handler
-from .types import Common
+from .scrape import STEP_TIMEOUT_MS, SCROLL_IDLE_MS, invoice_rows
+from .session import SESSION_PATH, SESSION_PROBE_MS, read_session, write_session
+from .timing import timed_step
+from .types import DEFAULT_CUSTOMER_NAME, Common
 from .log import logger
+from .manifest import Manifest
 from .__about__ import __version__
 from install_playwright import install
 
@@ -17,15 +22,33 @@ class AsyncScraper:
         login_secs: int = 20,
         limit_invoices: int = 0,
         *,
+        concurrency: int = 1,
+        retries: int = 2,
+        persist_session: bool = False,
+        session_path: Path = SESSION_PATH,
+        incremental: bool = False,
+        on_download: Callable[[Path], None] | None = None,
+        customer_name: str = DEFAULT_CUSTOMER_NAME,
+        row_selector: str | None = None,
+        browser: Browser | None = None,
         common: Common | None = None,
     ):
         self.common = common
+        self.customer_name = customer_name  # Shown on the invoice rows of the account
+        self.row_selector = row_selector  # Selector of the invoice rows, instead of the customer name
+        self.owns_browser = browser is None  # A shared browser is launched and closed by its owner
+        self.on_download = on_download  # Called with the path of each saved invoice
+        self.incremental = incremental  # Stop at the first invoice already in the manifest
+        self.persist_session = persist_session  # Store and restore the authenticated session
+        self.session_path = session_path
+        self.concurrency = max(concurrency, 1)  # Pages downloading invoices in parallel
+        self.retries = retries  # Retries of a failing invoice download
         self.download_path = download_path
         self.filename_prefix = None
         self.my_account_url = None
         self.login_url = None
         self.context = None
-        self.browser = None
+        self.browser = browser
         self.playwright = None
         self.limit_invoices = limit_invoices
         self.login_secs = login_secs  # Timeout before 2FA expires
@@ -36,11 +59,15 @@ class AsyncScraper:
 
     async def async_init(self):
         logger.info(f"Initializing scraper {__version__}")
-        self.playwright = await async_playwright().start()
-        logger.info(f"Installing playwright")
-        install(self.playwright.firefox)
-        self.browser = await self.playwright.firefox.launch(headless=False)
-        self.context = await self.browser.new_context()
+        if self.owns_browser:
+            self.playwright = await async_playwright().start()
+            logger.info(f"Installing playwright")
+            install(self.playwright.firefox)
+            self.browser = await self.playwright.firefox.launch(headless=False)
+        # Each scraper has a context of its own, isolating the cookies of its account
+        self.context = await self.browser.new_context(
+            storage_state=read_session(self.session_path) if self.persist_session else None
+        )
         self.login_url = "https://idp.jonkopingenergi.se/Account/BankID?returnUrl=%2Fconnect%2Fauthorize%2Fcallback%3Fclient_id%3Dweb-MinaSidor%26redirect_uri%3Dhttps%253A%252F%252Fminasidor.jonkopingenergi.se%252Fsignin-oidc%26response_type%3Dcode%26scope%3Dopenid%2520offline_access%26type%3Dprivate"
         self.my_account_url = "https://minasidor.jonkopingenergi.se/"
         self.filename_prefix = self.common.filename_prefix if self.common else "invoice_"
@@ -50,32 +77,110 @@ class AsyncScraper:
         assert self.download_path.exists(), "Download path does not exist"
 
     @staticmethod
-    async def scroll_to_bottom(page):
-        _prev_height = -1
-        _max_scrolls = 20
-        _scroll_count = 0
-        while _scroll_count < _max_scrolls:
-            await page.keyboard.down("End")
-            await page.wait_for_timeout(1000)
-            _scroll_count += 1
-            logger.info(f"scrolling to bottom - {_scroll_count / _max_scrolls:.0%}")
+    async def scroll_to_bottom(page, rows: Locator, idle_ms: int = SCROLL_IDLE_MS):
+        """Press 'End' until no new rows are loaded within the idle timeout."""
+        count = await rows.count()
+        while True:
+            await page.keyboard.press("End")
+            try:
+                await expect(rows).not_to_have_count(count, timeout=idle_ms)
+            except AssertionError:
+                break
+            count = await rows.count()
+            logger.info(f"scrolling to bottom - {count} rows loaded")
 
     @staticmethod
     async def scroll_to_top(page):
-        _prev_height = -1
-        _max_scrolls = 20
-        _scroll_count = 0
-        while _scroll_count < _max_scrolls:
-            await page.keyboard.down("Home")
-            await page.wait_for_timeout(1000)
-            _scroll_count += 1
-            logger.info(f"scrolling to top - {_scroll_count / _max_scrolls:.0%}")
+        await page.keyboard.press("Home")
+        await page.wait_for_function("() => window.scrollY === 0", timeout=STEP_TIMEOUT_MS)
 
-    @staticmethod
-    async def pause(page, time_ms=1000):
-        await page.wait_for_timeout(time_ms)
+    async def has_valid_session(self, page) -> bool:
+        await page.goto(self.my_account_url)
+        try:
+            await expect(page.get_by_role("link", name="Fakturor", exact=True)).to_be_visible(
+                timeout=SESSION_PROBE_MS
+            )
+        except AssertionError:
+            return False
+        return True
+
+    async def login(self, page) -> None:
+        if self.persist_session and read_session(self.session_path):
+            if await self.has_valid_session(page):
+                logger.info("Restored session is valid, skipping BankID login")
+                return
+            logger.info("Restored session has expired, login using BankID")
+        await page.goto(self.login_url)
+        await expect(
+            page.get_by_role("button", name="BankID logga BankID med QR-kod")
+        ).to_be_visible(timeout=STEP_TIMEOUT_MS)
+        await page.get_by_role("button", name="BankID logga BankID med QR-kod").click()
+        logger.info(
+            f"Waiting for you to login using BankID on your device - {self.login_secs} seconds timeout ..."
+        )
+        await page.wait_for_url(f"{self.my_account_url}**", timeout=self.login_secs * 1000)
+        if self.persist_session:
+            write_session(await self.context.storage_state(), self.session_path)
+
+    async def open_invoice_list(self, page) -> Locator:
+        """Navigate to the invoices of the account and return the locator of its rows."""
+        await page.goto(self.my_account_url)
+        await expect(page.get_by_role("link", name="Fakturor", exact=True)).to_be_visible(timeout=STEP_TIMEOUT_MS)
+        await page.get_by_role("link", name="Fakturor", exact=True).click()
+        rows = invoice_rows(page, self.customer_name, self.row_selector)
+        await expect(rows.nth(1)).to_be_visible(timeout=STEP_TIMEOUT_MS)
+        await rows.nth(1).click()
+        await page.wait_for_load_state("networkidle")
+        await rows.nth(1).click()
+        await page.wait_for_load_state("networkidle")
+        return rows
+
+    async def download_invoice(self, page, rows: Locator, expanded: set[int], idx: int) -> Path | None:
+        """
+        Expand the row of invoice idx and save its PDF to a temporary file, returns None if there
+        is no such row or the row has no PDF.
+
+        Expanded rows of the page are tracked as their PDF buttons are listed in row order.
+        """
+        row = rows.nth(idx + 1)
+        while await rows.count() <= idx + 1:
+            await page.keyboard.press("End")
+            try:
+                await expect(rows).not_to_have_count(await rows.count(), timeout=SCROLL_IDLE_MS)
+            except AssertionError:
+                return None
+        logger.info(f"clicking on row {idx}")
+        await row.click()
+        expanded.add(idx)
+        pdf_buttons = page.get_by_text("Visa PDF-faktura", exact=True)
+        position = len([i for i in expanded if i < idx])
+        try:
+            await expect(pdf_buttons).to_have_count(len(expanded), timeout=STEP_TIMEOUT_MS)
+        except AssertionError:
+            expanded.discard(idx)
+            return None
+        pdf_button = pdf_buttons.nth(position)
+        logger.info(f"Currently {len(expanded)} expanded, clicking on idx {position}")
+        async with page.expect_download() as download_info:
+            await pdf_button.scroll_into_view_if_needed()
+            await pdf_button.click()
+        download = download_info.value
+        fn = self.download_path / f".{self.filename_prefix}{idx}.part"
+        d = await download
+        await d.save_as(fn.as_posix())
+        return fn
 
     async def download_invoices(self) -> None:
+        """
+        Login using BankID and download the invoices as PDF files.
+
+        With concurrency above one, further pages are opened within the same authenticated
+        context and invoices are downloaded in parallel, each retried on failure. Files are
+        named by date and invoice number and recorded in the manifest of the download folder.
+        In incremental mode invoices are downloaded newest first, in rounds of concurrency
+        invoices, until one already in the manifest is reached. Invoices failing all retries
+        do not stop the others, they are raised together once the remaining ones are saved.
+        """
         for _ in range(10):
             logger.info(f"Waiting for scraper to be ready - attempt {_ + 1}")
             if self.ready_start and self.context is not None:
@@ -86,62 +191,115 @@ class AsyncScraper:
         else:
             assert False, "Scraper not ready"
         page = await self.context.new_page()
-        await page.goto(self.login_url)
-        await expect(
-            page.get_by_role("button", name="BankID logga BankID med QR-kod")
-        ).to_be_visible()
-        await page.get_by_role("button", name="BankID logga BankID med QR-kod").click()
-        for time_elapsed in range(self.login_secs):
-            logger.info(
-                f"Waiting for you to login using BankID on your device - {self.login_secs - time_elapsed} seconds left ..."
-            )
-            await self.pause(page)
-        await page.goto(self.my_account_url)
-        await expect(page.get_by_role("link", name="Fakturor", exact=True)).to_be_visible()
-        await page.get_by_role("link", name="Fakturor", exact=True).click()
-        await self.pause(page, 10000)
-        p = await page.get_by_text("Daniel Engvall", exact=True).all()
-        await p[1].click()
-        await self.pause(page)
-        p = await page.get_by_text("Daniel Engvall", exact=True).all()
-        await p[1].click()
-        await self.pause(page)
-        await self.scroll_to_bottom(page)
-        all_rows = await page.get_by_text("Daniel Engvall", exact=True).all()
-        await self.scroll_to_top(page)
+        page.set_default_timeout(STEP_TIMEOUT_MS)
+        with timed_step("login"):
+            await self.login(page)
+        with timed_step("open invoices"):
+            rows = await self.open_invoice_list(page)
+        manifest = Manifest(self.download_path, self.filename_prefix)
+        if self.incremental:
+            row_count = await rows.count()
+        else:
+            with timed_step("list invoices"):
+                await self.scroll_to_bottom(page, rows)
+                row_count = await rows.count()
+                await self.scroll_to_top(page)
+        max_invoices = None
         if self.limit_invoices:
             assert self.limit_invoices > 1, "Limit must be greater than 1"
-            process_rows = all_rows[1 : self.limit_invoices]
-        else:
-            process_rows = all_rows[1:]
-        for idx, r in enumerate(process_rows):
-            logger.info(f"clicking on row {idx} of {len(all_rows)}")
-            await r.click()
-            await self.pause(page)
-            all_pdf_buttons = await page.get_by_text("Visa PDF-faktura", exact=True).all()
-            logger.info(
-                f"Currently {len(all_pdf_buttons)} expanded, clicking on idx {idx}"
-            )
+            max_invoices = self.limit_invoices - 1
+        indexes = list(range(min(row_count - 1, max_invoices or row_count)))
+        logger.info(f"Downloading {len(indexes)} invoices using {self.concurrency} page(s)")
+
+        with timed_step("open pages"):
+            pages = asyncio.Queue()
+            await pages.put((page, rows, set()))
+            for _ in range(max(min(self.concurrency, len(indexes)), 1) - 1):
+                extra_page = await self.context.new_page()
+                extra_page.set_default_timeout(STEP_TIMEOUT_MS)
+                await pages.put((extra_page, await self.open_invoice_list(extra_page), set()))
+
+        async def download(idx: int) -> bool | None:
+            """Download invoice idx, returns whether it was already known or None if not available."""
+            worker_page, worker_rows, expanded = await pages.get()
             try:
-                pdf_button = all_pdf_buttons[idx]
-            except IndexError:
-                logger.info(f"No more PDFs to download, exiting")
-                break
-            async with page.expect_download() as download_info:
-                await pdf_button.scroll_into_view_if_needed()
-                await pdf_button.click()
-            download = download_info.value
-            fn = self.download_path / f"{self.filename_prefix}{idx}.pdf"
-            d = await download
-            await d.save_as(fn.as_posix())
-            await self.pause(page)
-        logger.info("Done")
-        await page.get_by_role("button", name="Öppna profil").click()
-        await self.pause(page)
-        await page.get_by_role("button", name="Logga ut").click()
-        await self.pause(page)
+                for attempt in range(1, self.retries + 2):
+                    try:
+                        with timed_step("download invoice", invoice=idx) as step:
+                            fn = await self.download_invoice(worker_page, worker_rows, expanded, idx)
+                            step["bytes"] = fn.stat().st_size if fn else 0
+                        if fn is None:
+                            return None
+                        entry, known = manifest.store(fn)
+                        if self.on_download:
+                            self.on_download(self.download_path / entry.filename)
+                        return known
+                    except (PlaywrightError, AssertionError) as e:
+                        logger.warning(f"Attempt {attempt} of invoice {idx} failed: {e}")
+                        if attempt > self.retries:
+                            raise
+                        # Start over from a fresh list as the state of the page is unknown
+                        expanded.clear()
+                        worker_rows = await self.open_invoice_list(worker_page)
+            finally:
+                await pages.put((worker_page, worker_rows, expanded))
+
+        failed: dict[int, Exception] = {}
+
+        async def download_all(idxs: list[int]) -> dict[int, bool | None]:
+            """Download invoices in parallel, a failing invoice does not stop the others and is left out."""
+            results = await asyncio.gather(*(download(idx) for idx in idxs), return_exceptions=True)
+            for idx, result in zip(idxs, results):
+                if isinstance(result, BaseException) and not isinstance(result, Exception):
+                    raise result
+                if isinstance(result, Exception):
+                    failed[idx] = result
+            return {idx: result for idx, result in zip(idxs, results) if not isinstance(result, Exception)}
+
+        # Invoices stored before a failure are kept in the manifest and the extra pages closed
+        try:
+            if self.incremental:
+                start = 0
+                while max_invoices is None or start < max_invoices:
+                    stop = start + self.concurrency
+                    if max_invoices is not None:
+                        stop = min(stop, max_invoices)
+                    results = await download_all(list(range(start, stop)))
+                    if any(results.values()):
+                        logger.info("Reached an invoice already downloaded, stopping")
+                        break
+                    if None in results.values():
+                        break
+                    start = stop
+            else:
+                results = await download_all(indexes)
+                if None in results.values():
+                    logger.info(f"No PDF for invoices {[idx for idx, known in results.items() if known is None]}")
+        finally:
+            manifest.save()
+            while not pages.empty():
+                worker_page, _, _ = pages.get_nowait()
+                if worker_page is not page:
+                    await worker_page.close()
+        if failed:
+            logger.error(f"Failed downloading invoices {sorted(failed)} after {self.retries} retries")
+        else:
+            logger.info("Done")
+        if self.persist_session:
+            # Logging out would invalidate the stored session
+            write_session(await self.context.storage_state(), self.session_path)
+        else:
+            with timed_step("logout"):
+                await page.get_by_role("button", name="Öppna profil").click()
+                await expect(page.get_by_role("button", name="Logga ut")).to_be_visible(timeout=STEP_TIMEOUT_MS)
+                await page.get_by_role("button", name="Logga ut").click()
+                await page.wait_for_load_state("networkidle")
         await page.close()
+        if failed:
+            raise ExceptionGroup(f"Failed downloading invoices {sorted(failed)}", list(failed.values()))
 
     async def close(self):
         await self.context.close()
-        await self.browser.close()
+        if self.owns_browser:
+            await self.browser.close()
+            await self.playwright.stop()
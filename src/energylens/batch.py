@@ -0,0 +1,131 @@
+import asyncio
+import dataclasses
+import json
+import time
+from pathlib import Path
+from typing import Literal
+
+from energylens.log import logger
+from energylens.session import SESSION_PATH
+from energylens.timing import timed_step
+from energylens.types import DEFAULT_CUSTOMER_NAME, Common
+
+
+@dataclasses.dataclass(frozen=True)
+class Account:
+    """An account of a household, its invoice rows are found by the customer name or the row selector."""
+
+    name: str
+    download_path: Path
+    customer_name: str = DEFAULT_CUSTOMER_NAME
+    row_selector: str | None = None
+    session_path: Path | None = None  # None stores the session next to the one of single account runs
+
+    @property
+    def session_file(self) -> Path:
+        return self.session_path or SESSION_PATH.with_name(f"storage_state_{self.name}.json")
+
+
+@dataclasses.dataclass
+class AccountStatus:
+    account: str
+    status: Literal["ok", "failed"]
+    invoices: int = 0  # Invoices saved, including those already in the manifest
+    seconds: float = 0.0
+    error: str | None = None
+
+
+def load_accounts(path: Path) -> list[Account]:
+    """
+    Read accounts from a JSON list, relative download and session paths are relative to the file.
+
+        [{"name": "home", "download_path": "home", "customer_name": "Jane Doe"},
+         {"name": "cabin", "download_path": "cabin", "row_selector": "text=Stugan"}]
+
+    Each account must have a customer name or a row selector, otherwise all accounts would
+    download the invoice rows of the default customer name.
+    """
+    accounts = []
+    for entry in json.loads(path.read_text(encoding="utf-8")):
+        if not entry.get("customer_name") and not entry.get("row_selector"):
+            raise ValueError(f"Account {entry.get('name')!r} needs a customer_name or a row_selector")
+        for key in ("download_path", "session_path"):
+            if entry.get(key):
+                entry[key] = path.parent / Path(entry[key]).expanduser()
+        accounts.append(Account(**entry))
+    names = [account.name for account in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Account names must be unique: {names}")
+    return accounts
+
+
+async def download_accounts(
+    accounts: list[Account],
+    *,
+    max_accounts: int = 2,
+    login_secs: int = 20,
+    limit_invoices: int = 0,
+    concurrency: int = 1,
+    persist_session: bool = False,
+    incremental: bool = False,
+    common: Common | None = None,
+) -> list[AccountStatus]:
+    """
+    Download the invoices of several accounts using one browser, each account in a context of its own.
+
+    At most max_accounts accounts are logged in and downloaded at the same time, each using
+    concurrency pages. A failing account does not stop the others, its error is part of its status.
+    """
+    from playwright.async_api import async_playwright
+    from install_playwright import install
+
+    from energylens.async_scrape import AsyncScraper
+
+    slots = asyncio.Semaphore(max(max_accounts, 1))
+
+    async def download(account: Account, browser) -> AccountStatus:
+        async with slots:
+            saved = []
+            account.download_path.mkdir(parents=True, exist_ok=True)
+            scraper = AsyncScraper(
+                download_path=account.download_path,
+                login_secs=login_secs,
+                limit_invoices=limit_invoices,
+                concurrency=concurrency,
+                persist_session=persist_session,
+                session_path=account.session_file,
+                incremental=incremental,
+                on_download=saved.append,
+                customer_name=account.customer_name,
+                row_selector=account.row_selector,
+                browser=browser,
+                common=common,
+            )
+            start = time.perf_counter()
+            try:
+                with timed_step("account", account=account.name):
+                    await scraper.async_init()
+                    try:
+                        await scraper.download_invoices()
+                    finally:
+                        await scraper.close()
+            except Exception as e:
+                logger.error(f"Account {account.name} failed: {e.__class__.__name__} {e}")
+                return AccountStatus(
+                    account.name, "failed", len(saved), time.perf_counter() - start, f"{e.__class__.__name__}: {e}"
+                )
+            return AccountStatus(account.name, "ok", len(saved), time.perf_counter() - start)
+
+    async with async_playwright() as playwright:
+        install(playwright.firefox)
+        browser = await playwright.firefox.launch(headless=False)
+        try:
+            statuses = await asyncio.gather(*(download(account, browser) for account in accounts))
+        finally:
+            await browser.close()
+    for status in statuses:
+        logger.info(
+            f"{'✅' if status.status == 'ok' else '❌'} {status.account}: {status.invoices} invoices "
+            f"in {status.seconds:.1f}s{f' - {status.error}' if status.error else ''}"
+        )
+    return statuses
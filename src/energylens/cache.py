@@ -0,0 +1,132 @@
+import hashlib
+import importlib.metadata
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import platformdirs
+import polars as pl
+
+from energylens.file_utils import atomic_write
+from energylens.log import logger
+from .__about__ import __version__
+
+if TYPE_CHECKING:
+    from docling_core.types.doc import DoclingDocument
+
+CACHE_PATH = platformdirs.user_cache_path("energylens") / "parse"
+DOCUMENTS_PATH = platformdirs.user_cache_path("energylens") / "documents"
+
+# Modules whose content decide the extracted rows, any change invalidates the cache
+_PARSER_MODULES = (
+    "parse.py",
+    "docling_parser.py",
+    "pypdf_parser.py",
+    "number_utils.py",
+    "validation.py",
+    "schema.py",
+)
+
+
+def parser_version() -> str:
+    """Fingerprint of the parsing code, used to invalidate stale cache entries."""
+    h = hashlib.sha256(__version__.encode())
+    for name in _PARSER_MODULES:
+        h.update((Path(__file__).parent / name).read_bytes())
+    return h.hexdigest()[:16]
+
+
+def file_hash(path: Path) -> str:
+    """Return SHA-256 of the content of a file."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class ParseCache:
+    """
+    Persistent on-disk cache of parsed invoice rows keyed by PDF content and parser version.
+
+    Entries of different parser settings (e.g. strategy) are kept apart by the variant.
+    """
+
+    def __init__(self, cache_path: Path = CACHE_PATH, version: str | None = None, variant: str = "default"):
+        self.path = cache_path / (version or parser_version()) / variant
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, key: str) -> Path:
+        return self.path / f"{key}.parquet"
+
+    def __contains__(self, key: str) -> bool:
+        return self._entry(key).exists()
+
+    def get(self, key: str) -> pl.DataFrame | None:
+        entry = self._entry(key)
+        if entry.exists():
+            self.hits += 1
+            return pl.read_parquet(entry)
+        return None
+
+    def put(self, key: str, df: pl.DataFrame) -> None:
+        """Store the parsed row of a PDF that was not found in the cache."""
+        self.misses += 1
+        with atomic_write(self._entry(key)) as tmp_path:
+            df.write_parquet(tmp_path)
+
+    def report(self) -> None:
+        logger.info(f"Parse cache: {self.hits} hits, {self.misses} misses ({self.path.as_posix()})")
+
+
+def docling_version() -> str:
+    """Version of the installed Docling, conversions of other versions are not reused."""
+    try:
+        return importlib.metadata.version("docling")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+class DocumentStore:
+    """
+    Persistent on-disk store of converted Docling documents keyed by PDF content and conversion settings.
+
+    The documents do not depend on the extraction rules, unlike the rows of `ParseCache`,
+    so changed rules are applied to them without running the Docling models again.
+    Entries of different pipeline profiles and Docling versions are kept apart.
+    Only the pages needed at the time are converted, their indexes are stored with the document.
+    """
+
+    def __init__(self, variant: str, store_path: Path = DOCUMENTS_PATH, version: str | None = None):
+        self.path = store_path / (version or docling_version()) / variant
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _entry(self, key: str) -> Path:
+        return self.path / f"{key}.json"
+
+    def _pages_entry(self, key: str) -> Path:
+        return self.path / f"{key}.pages.json"
+
+    def __contains__(self, key: str) -> bool:
+        return self._entry(key).exists()
+
+    def get(self, key: str) -> "DoclingDocument | None":
+        from docling_core.types.doc import DoclingDocument
+
+        entry = self._entry(key)
+        if entry.exists():
+            return DoclingDocument.load_from_json(entry)
+        return None
+
+    def stored_pages(self, key: str) -> list[int] | None:
+        """Indexes of the PDF pages converted into the stored document, None if not recorded."""
+        entry = self._pages_entry(key)
+        return json.loads(entry.read_text()) if entry.exists() else None
+
+    def put(self, key: str, doc: "DoclingDocument", pages: list[int]) -> None:
+        from docling_core.types.doc import ImageRefMode
+
+        with atomic_write(self._pages_entry(key)) as tmp_path:
+            tmp_path.write_text(json.dumps(pages))
+        # Page and picture images are not needed for extraction, only their placeholders are kept
+        with atomic_write(self._entry(key)) as tmp_path:
+            doc.save_as_json(tmp_path, image_mode=ImageRefMode.PLACEHOLDER, indent=0)
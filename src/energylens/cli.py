@@ -1,17 +1,28 @@
-import tempfile
+import asyncio
+import datetime
+import functools
+from collections import Counter
 from pathlib import Path
-from typing import Annotated, Literal
+from typing import Annotated
 
-from energylens.pypdf_parser import parse_html_to_pl_using_pypdf
-from energylens.types import Common
+from energylens.types import (
+    DEFAULT_CUSTOMER_NAME,
+    Common,
+    Device,
+    DoclingPreset,
+    DoclingProfile,
+    OutputFormat,
+    Strategy,
+    TableMode,
+    UtilityName,
+)
 from .log import logger
+from .timing import profiling
 import cyclopts
 from cyclopts import validators, Parameter
 from . import __version__
 
-from .scrape import Scraper
-from .docling_parser import parse_html_to_pl_using_docling, convert_pdf_to_html
-import polars as pl
+# Heavy dependencies (playwright, docling, polars, ...) are imported by the commands needing them
 import warnings
 
 warnings.filterwarnings("ignore", module="torch")
@@ -24,9 +35,23 @@ cli_app = cyclopts.App(
 )
 
 DOWNLOAD_PATH = platformdirs.user_downloads_path()
+# HTTP connections are cheap compared to browser pages
+DIRECT_HTTP_CONCURRENCY = 4
+
+
+def profiled(command):
+    """Record the stages of a command and print a summary when --profile is given."""
+
+    @functools.wraps(command)
+    def wrapper(*args, common: Common | None = None, **kwargs):
+        with profiling(common.profile if common else None):
+            return command(*args, common=common, **kwargs)
+
+    return wrapper
 
 
 @cli_app.command()
+@profiled
 def download_invoices(
     invoice_path: Annotated[
         Path,
@@ -38,6 +63,39 @@ def download_invoices(
         int, Parameter(help="Number of seconds to wait for 2FA to expire.")
     ] = 20,
     limit_invoices: Annotated[int, Parameter(help="Max months back to process")] = 0,
+    concurrency: Annotated[
+        int | None,
+        Parameter(
+            validator=validators.Number(gte=1),
+            help=(
+                "Number of browser pages downloading invoices in parallel, or of HTTP connections with "
+                f"direct HTTP. Defaults to 1, or {DIRECT_HTTP_CONCURRENCY} with direct HTTP."
+            ),
+        ),
+    ] = None,
+    persist_session: Annotated[
+        bool,
+        Parameter(
+            help="Store the authenticated session and reuse it on later runs, skipping BankID while it is valid."
+        ),
+    ] = False,
+    incremental: Annotated[
+        bool,
+        Parameter(help="Only download invoices newer than those already in the download manifest."),
+    ] = False,
+    direct_http: Annotated[
+        bool,
+        Parameter(
+            help="Only use the browser for the login, then fetch the invoice list and PDFs directly over HTTP."
+        ),
+    ] = False,
+    customer_name: Annotated[
+        str, Parameter(help="Customer name shown on the invoice rows of the account.")
+    ] = DEFAULT_CUSTOMER_NAME,
+    row_selector: Annotated[
+        str | None,
+        Parameter(help="Playwright selector of the invoice rows, used instead of the customer name."),
+    ] = None,
     *,
     common: Common | None = None,
 ):
@@ -47,13 +105,40 @@ def download_invoices(
     Downloads invoices using a scraper, with additional configurations for login
     timeout and the limit on the number of months for which to process invoices.
     The downloaded invoices are saved to the given path. Optionally, accepts a
-    common configuration object.
+    common configuration object. With a concurrency above one the invoices are
+    downloaded in parallel using several pages of the same browser session.
+    A persisted session is kept in a file readable only by the current user.
+    Files are named by date and invoice number and recorded in a manifest within the download path.
+    With direct HTTP the endpoints called by the portal are discovered after login and the
+    invoices are fetched concurrently using the cookies of the browser session.
     """
     logger.info(f"Starting {__name__} {__version__}")
+    if direct_http:
+        asyncio.run(
+            _async_download_invoices(
+                invoice_path, login_timout, limit_invoices, concurrency or DIRECT_HTTP_CONCURRENCY,
+                persist_session, incremental, common, direct_http=True, customer_name=customer_name, row_selector=row_selector,
+            )
+        )
+        return
+    if concurrency is not None and concurrency > 1:
+        asyncio.run(
+            _async_download_invoices(
+                invoice_path, login_timout, limit_invoices, concurrency, persist_session, incremental, common,
+                customer_name=customer_name, row_selector=row_selector,
+            )
+        )
+        return
+    from .scrape import Scraper
+
     scraper = Scraper(
         download_path=invoice_path,
         login_secs=login_timout,
         limit_invoices=limit_invoices,
+        persist_session=persist_session,
+        incremental=incremental,
+        customer_name=customer_name,
+        row_selector=row_selector,
         common=common,
     )
     scraper.download_invoices()
@@ -61,6 +146,111 @@ def download_invoices(
 
 
 @cli_app.command()
+@profiled
+def download_accounts(
+    accounts_file: Annotated[
+        Path,
+        Parameter(
+            validator=validators.Path(exists=True),
+            help="JSON list of accounts with name, download_path and customer_name or row_selector.",
+        ),
+    ],
+    max_accounts: Annotated[
+        int,
+        Parameter(
+            validator=validators.Number(gte=1),
+            help="Number of accounts logged in and downloaded at the same time.",
+        ),
+    ] = 2,
+    login_timout: Annotated[
+        int, Parameter(help="Number of seconds to wait for 2FA to expire.")
+    ] = 20,
+    limit_invoices: Annotated[int, Parameter(help="Max months back to process")] = 0,
+    concurrency: Annotated[
+        int,
+        Parameter(
+            validator=validators.Number(gte=1),
+            help="Number of browser pages downloading invoices in parallel per account.",
+        ),
+    ] = 1,
+    persist_session: Annotated[
+        bool,
+        Parameter(
+            help="Store the authenticated session of each account and reuse it on later runs."
+        ),
+    ] = False,
+    incremental: Annotated[
+        bool,
+        Parameter(help="Only download invoices newer than those already in the download manifest."),
+    ] = False,
+    *,
+    common: Common | None = None,
+):
+    """
+    Downloads the invoices of several accounts, e.g. of several households, to a folder per account.
+
+    A single browser is launched and each account is logged in within a context of its own,
+    isolating their sessions. Accounts are processed concurrently up to max accounts at a time,
+    each requiring its own BankID login unless a persisted session is still valid.
+    The status, invoice count and duration of each account are logged at the end of the run.
+    """
+    from .batch import download_accounts as download, load_accounts
+
+    logger.info(f"Starting {__name__} {__version__}")
+    accounts = load_accounts(accounts_file)
+    statuses = asyncio.run(
+        download(
+            accounts,
+            max_accounts=max_accounts,
+            login_secs=login_timout,
+            limit_invoices=limit_invoices,
+            concurrency=concurrency,
+            persist_session=persist_session,
+            incremental=incremental,
+            common=common,
+        )
+    )
+    if failed := [status.account for status in statuses if status.status == "failed"]:
+        logger.warning(f"Failed accounts: {', '.join(failed)}")
+
+
+async def _async_download_invoices(
+    invoice_path: Path,
+    login_secs: int,
+    limit_invoices: int,
+    concurrency: int,
+    persist_session: bool,
+    incremental: bool,
+    common: Common | None,
+    direct_http: bool = False,
+    customer_name: str = DEFAULT_CUSTOMER_NAME,
+    row_selector: str | None = None,
+) -> None:
+    from .async_scrape import AsyncScraper
+
+    scraper = AsyncScraper(
+        download_path=invoice_path,
+        login_secs=login_secs,
+        limit_invoices=limit_invoices,
+        concurrency=concurrency,
+        persist_session=persist_session,
+        incremental=incremental,
+        customer_name=customer_name,
+        row_selector=row_selector,
+        common=common,
+    )
+    if direct_http:
+        from .http_fetch import download_invoices_over_http
+
+        await download_invoices_over_http(scraper, concurrency=concurrency)
+        return
+    await scraper.async_init()
+    await scraper.download_invoices()
+    await scraper.close()
+
+
+@cli_app.command()
+@profiled
 def parse_invoices(
     invoice_path: Annotated[
         Path,
@@ -69,44 +259,247 @@ def parse_invoices(
         ),
     ] = DOWNLOAD_PATH,
     output_file: Annotated[
-        Path, Parameter(help="Path to output parsed invoices to.")
+        Path,
+        Parameter(
+            help="Path to output parsed invoices to, a directory for the dataset format."
+        ),
+    ] = DOWNLOAD_PATH / "invoices.parquet",
+    output_format: Annotated[
+        OutputFormat, Parameter(help="Output format.")
+    ] = "parquet",
+    use_cache: Annotated[
+        bool, Parameter(help="Reuse previously parsed rows for unchanged PDFs.")
+    ] = True,
+    strategy: Annotated[
+        Strategy,
+        Parameter(
+            help="docling: Docling with pypdf as fallback, tiered: pypdf first and Docling only for invalid results."
+        ),
+    ] = "docling",
+    docling_profile: Annotated[
+        DoclingPreset,
+        Parameter(
+            help="default: OCR and accurate tables, fast: no OCR for PDFs with a text layer, e.g. downloaded invoices."
+        ),
+    ] = "default",
+    table_mode: Annotated[
+        TableMode | None,
+        Parameter(help="Docling table structure mode, overrides the one of the profile."),
+    ] = None,
+    docling_threads: Annotated[
+        int | None,
+        Parameter(
+            validator=validators.Number(gte=1),
+            help="Threads of the Docling models, default the Docling default.",
+        ),
+    ] = None,
+    docling_device: Annotated[
+        Device, Parameter(help="Device the Docling models run on.")
+    ] = "auto",
+    workers: Annotated[
+        int,
+        Parameter(
+            validator=validators.Number(gte=1),
+            help="Number of worker processes parsing invoices in parallel.",
+        ),
+    ] = 1,
+    worker_threads: Annotated[
+        int,
+        Parameter(
+            validator=validators.Number(gte=1), help="Torch threads per worker process."
+        ),
+    ] = 1,
+    worker_max_tasks: Annotated[
+        int,
+        Parameter(
+            validator=validators.Number(gte=1),
+            help="Invoices parsed by a worker before it is replaced, bounds memory.",
+        ),
+    ] = 50,
+    batch_size: Annotated[
+        int,
+        Parameter(
+            validator=validators.Number(gte=1),
+            help="Number of invoices buffered before being written to the output.",
+        ),
+    ] = 20,
+    *,
+    common: Common | None = None,
+):
+    """
+    Parses the invoice PDFs of a folder into one row per invoice, saved in the desired format.
+
+    Docling converts the pages holding the tables and the invoice header, its tables are classified
+    and the fields extracted. The pypdf/regex parser is the fallback, or the first choice of the
+    tiered strategy. Rows of PDFs parsed before are read from an on-disk cache and converted Docling
+    documents are stored for the reextract command. Remaining PDFs may be parsed by several worker
+    processes, rows are written in batches so that progress is kept if the run is aborted.
+    The dataset format upserts the rows by invoice number into a parquet dataset partitioned by year.
+    The parser producing each row is recorded in the parser column and summarised at the end of the run.
+    """
+    from .parse import parse_invoice_files, PARSER_COLUMN
+    from .cache import ParseCache
+    from .sink import InvoiceWriter
+
+    prefix = common.filename_prefix if common else "invoice_"
+    logger.info(f"Starting {__name__} {__version__}")
+    docling = DoclingProfile.preset(docling_profile, table_mode, docling_threads, docling_device)
+    cache = ParseCache(variant=f"{strategy}-{docling.key}") if use_cache else None
+    pdf_files = sorted(invoice_path.glob(f"{prefix}*.pdf"), key=lambda x: x.name)
+    parsers_used = Counter()
+    with InvoiceWriter(output_file, output_format, batch_size) as writer:
+        for invoice_df in parse_invoice_files(
+            pdf_files,
+            cache,
+            workers,
+            strategy=strategy,
+            docling=docling,
+            threads_per_worker=worker_threads,
+            max_tasks_per_worker=worker_max_tasks,
+        ):
+            parsers_used.update(invoice_df[PARSER_COLUMN])
+            writer.write(invoice_df)
+    if cache:
+        cache.report()
+    logger.info(f"Parsers used: {', '.join(f'{k}={v}' for k, v in sorted(parsers_used.items()))}")
+    logger.info(f"Finished - saved to {output_file.as_posix()}")
+
+
+@cli_app.command()
+@profiled
+def reextract(
+    invoice_path: Annotated[
+        Path,
+        Parameter(
+            validator=validators.Path(exists=True), help="Path to download invoices to."
+        ),
+    ] = DOWNLOAD_PATH,
+    output_file: Annotated[
+        Path,
+        Parameter(
+            help="Path to output parsed invoices to, a directory for the dataset format."
+        ),
     ] = DOWNLOAD_PATH / "invoices.parquet",
     output_format: Annotated[
-        Literal["parquet", "csv"], Parameter(help="Output format.")
+        OutputFormat, Parameter(help="Output format.")
     ] = "parquet",
+    strategy: Annotated[
+        Strategy,
+        Parameter(
+            help="docling: Docling with pypdf as fallback, tiered: pypdf first and Docling only for invalid results."
+        ),
+    ] = "docling",
+    docling_profile: Annotated[
+        DoclingPreset,
+        Parameter(help="Profile the Docling documents were converted with by parse-invoices."),
+    ] = "default",
+    table_mode: Annotated[
+        TableMode | None,
+        Parameter(help="Docling table structure mode the documents were converted with."),
+    ] = None,
+    batch_size: Annotated[
+        int,
+        Parameter(
+            validator=validators.Number(gte=1),
+            help="Number of invoices buffered before being written to the output.",
+        ),
+    ] = 20,
     *,
     common: Common | None = None,
 ):
     """
-    Parses invoice files in the specified location and saves the parsed output to a file in the desired format.
+    Re-applies the current extraction rules to the Docling documents stored by parse-invoices.
 
-    This function processes PDF files, converts them to HTML, and then extracts the invoice data using
-    two different parsers. The parsed data is consolidated and saved in the specified output file and format.
+    Docling documents converted by parse-invoices are kept on disk, this command classifies their tables
+    and extracts the fields again without running the Docling models, e.g. after changing the rules.
+    Invoices without a stored document, or whose document lacks pages now needed, are parsed
+    by pypdf, as when Docling fails.
     """
+    from .parse import reextract_invoice_files, PARSER_COLUMN
+    from .sink import InvoiceWriter
+
     prefix = common.filename_prefix if common else "invoice_"
     logger.info(f"Starting {__name__} {__version__}")
-    output_df = pl.DataFrame()
-    for f in sorted(invoice_path.glob(f"{prefix}*.pdf"), key=lambda x: x.name):
-        logger.info(f"Parsing {f.as_posix()}")
-        html_content = convert_pdf_to_html(f)
-        with tempfile.NamedTemporaryFile() as tmp_file:
-            tmp_file.write(html_content.encode())
-            try:
-                invoice_df = parse_html_to_pl_using_docling(Path(tmp_file.name))
-            except (KeyError, IndexError) as e:
-                # logger.error(f'Error parsing invoice {f.as_posix()}: {e.__class__.__name__} {e}')
-                logger.info("Attempt to parse again with different parser")
-                invoice_df = parse_html_to_pl_using_pypdf(f)
-        output_df = pl.concat([invoice_df, output_df], how="diagonal_relaxed")
-        logger.info(f"✅ Parsed {f.as_posix()}")
-    match output_format:
-        case "parquet":
-            output_df.write_parquet(output_file)
-        case "csv":
-            output_df.write_csv(output_file)
+    docling = DoclingProfile.preset(docling_profile, table_mode)
+    pdf_files = sorted(invoice_path.glob(f"{prefix}*.pdf"), key=lambda x: x.name)
+    parsers_used = Counter()
+    with InvoiceWriter(output_file, output_format, batch_size) as writer:
+        for invoice_df in reextract_invoice_files(pdf_files, strategy=strategy, docling=docling):
+            parsers_used.update(invoice_df[PARSER_COLUMN])
+            writer.write(invoice_df)
+    logger.info(f"Parsers used: {', '.join(f'{k}={v}' for k, v in sorted(parsers_used.items()))}")
     logger.info(f"Finished - saved to {output_file.as_posix()}")
 
 
+@cli_app.command()
+@profiled
+def report(
+    source: Annotated[
+        Path,
+        Parameter(
+            validator=validators.Path(exists=True),
+            help="Parsed invoices, a parquet or ipc file or a dataset directory written by parse-invoices.",
+        ),
+    ] = DOWNLOAD_PATH / "invoices.parquet",
+    start: Annotated[
+        datetime.datetime | None, Parameter(help="First invoice month to report, e.g. 2023-01-01.")
+    ] = None,
+    end: Annotated[
+        datetime.datetime | None, Parameter(help="Last invoice month to report, e.g. 2024-12-01.")
+    ] = None,
+    utility: Annotated[
+        list[UtilityName] | None, Parameter(help="Utilities to report, default all.")
+    ] = None,
+    outlier_threshold: Annotated[
+        float,
+        Parameter(
+            validator=validators.Number(gt=0),
+            help="Standard deviations from the previous 12 months a month is flagged as outlier at.",
+        ),
+    ] = 3.0,
+    output_file: Annotated[
+        Path | None,
+        Parameter(help="File to write the report to, csv or parquet by its suffix, default print it."),
+    ] = None,
+    use_cache: Annotated[
+        bool, Parameter(help="Reuse the monthly aggregates of unchanged files.")
+    ] = True,
+    *,
+    common: Common | None = None,
+):
+    """
+    Reports monthly costs, usage and effective prices per utility with their changes and outliers.
+
+    The costs of each utility are summed per invoice month, the effective price is in öre/kWh for
+    electricity and kr/MWh for district heating. Changes to the previous month and the same month
+    the year before are relative, months deviating from the previous 12 months are flagged as outliers.
+    Monthly aggregates are cached per file, so only new or rewritten files, e.g. the partitions of
+    a dataset updated by parse-invoices, are read again.
+    """
+    import polars as pl
+
+    from .report import invoice_report
+
+    report_df = invoice_report(
+        source,
+        start=start.date() if start else None,
+        end=end.date() if end else None,
+        utilities=utility,
+        outlier_threshold=outlier_threshold,
+        use_cache=use_cache,
+    )
+    match output_file.suffix if output_file else None:
+        case None:
+            with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_width_chars=200, float_precision=2):
+                print(report_df)
+        case ".csv":
+            report_df.write_csv(output_file)
+        case _:
+            report_df.write_parquet(output_file)
+    if output_file:
+        logger.info(f"Report of {report_df.height} rows saved to {output_file.as_posix()}")
+
+
 def main():
     cli_app()
 
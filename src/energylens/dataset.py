@@ -0,0 +1,85 @@
+from pathlib import Path
+
+import polars as pl
+
+from energylens.file_utils import atomic_write
+from energylens.log import logger
+from energylens.schema import PARQUET_OPTIONS, conform_to_schema
+
+PARTITION_COLUMN = "year"
+KEY_COLUMN = "invoice_number"
+UNKNOWN_YEAR = 0  # Partition of invoices without a parsable date
+
+
+def _year_expr(df: pl.DataFrame) -> pl.Expr:
+    date = pl.col("date")
+    if df.schema["date"] == pl.String:
+        date = date.str.to_date(strict=False)
+    return date.dt.year().fill_null(UNKNOWN_YEAR).cast(pl.Int32).alias(PARTITION_COLUMN)
+
+
+def _deduplicate(df: pl.DataFrame, key: str = KEY_COLUMN) -> pl.DataFrame:
+    """Keep the last row of each key, rows without key are only deduplicated on all columns."""
+    return pl.concat(
+        [
+            df.filter(pl.col(key).is_not_null()).unique(subset=key, keep="last", maintain_order=True),
+            df.filter(pl.col(key).is_null()).unique(maintain_order=True),
+        ]
+    ).sort("date", key, nulls_last=True)
+
+
+def partition_file(root: Path, year: int) -> Path:
+    return root / f"{PARTITION_COLUMN}={year}" / "data.parquet"
+
+
+def _partition_years(root: Path, keys: pl.Series, key: str = KEY_COLUMN) -> set[int]:
+    """Years of the existing partitions holding any of the keys."""
+    if not any(root.glob(f"{PARTITION_COLUMN}=*/*.parquet")):
+        return set()
+    index = scan_dataset(root).select(key, PARTITION_COLUMN).filter(pl.col(key).is_in(keys.implode()))
+    return set(index.collect()[PARTITION_COLUMN].unique().to_list())
+
+
+def upsert_dataset(rows: pl.DataFrame, root: Path, key: str = KEY_COLUMN) -> list[Path]:
+    """
+    Merge rows into a parquet dataset partitioned by invoice year, deduplicated by key.
+
+    Rows replace existing rows having the same key in any partition, e.g. when a re-parsed
+    invoice got another date, so that each key is in a single partition. Only partitions whose
+    content change are rewritten, and each partition file is replaced atomically.
+    Returns the partition files written or removed.
+    """
+    written = []
+    rows = rows.with_columns(_year_expr(rows))
+    keys = rows[key].drop_nulls().unique()
+    new_by_year = rows.partition_by(PARTITION_COLUMN, as_dict=True, include_key=False)
+    years = {year for (year,) in new_by_year} | _partition_years(root, keys, key)
+    for year in sorted(years):
+        path = partition_file(root, year)
+        # Partitions written before the typed output schema are converted on their next upsert
+        existing = conform_to_schema(pl.read_parquet(path, hive_partitioning=False)) if path.exists() else None
+        parts = [] if existing is None else [existing.filter(~pl.col(key).is_in(keys.implode()).fill_null(False))]
+        if (year,) in new_by_year:
+            parts.append(new_by_year[(year,)])
+        merged = _deduplicate(pl.concat(parts, how="diagonal_relaxed"), key)
+        if existing is not None and merged.equals(existing):
+            logger.info(f"Partition {year} unchanged")
+            continue
+        if merged.is_empty():
+            path.unlink()
+            if not any(path.parent.iterdir()):
+                path.parent.rmdir()
+            logger.info(f"Partition {year} removed, its rows moved to other partitions")
+            written.append(path)
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(path) as tmp_path:
+            merged.write_parquet(tmp_path, **PARQUET_OPTIONS)
+        logger.info(f"Partition {year} written with {merged.height} rows")
+        written.append(path)
+    return written
+
+
+def scan_dataset(root: Path) -> pl.LazyFrame:
+    """Lazily scan a dataset, filters on the year column prune whole partitions."""
+    return pl.scan_parquet(root / "**" / "*.parquet", hive_partitioning=True)
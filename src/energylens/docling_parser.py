@@ -1,15 +1,24 @@
+import bisect
 import functools
+import re
+from io import BytesIO
 from pathlib import Path
 
-import bs4
 import pandas as pd
 import polars as pl
 import itertools
 import numpy as np
-from docling.document_converter import DocumentConverter
+from docling.datamodel.accelerator_options import AcceleratorDevice, AcceleratorOptions
+from docling.datamodel.base_models import DocumentStream, InputFormat
+from docling.datamodel.pipeline_options import PdfPipelineOptions, TableFormerMode
+from docling.document_converter import DocumentConverter, PdfFormatOption
+from docling_core.types.doc import DocItemLabel, DoclingDocument, SectionHeaderItem, TableItem, TextItem, TitleItem
+from pypdf import PdfReader, PdfWriter
 
 from energylens.log import logger
 from energylens.number_utils import _to_float
+from energylens.timing import span
+from energylens.types import DoclingProfile
 
 TableType = str
 TableTypeDict = dict[TableType, pd.DataFrame]
@@ -20,18 +29,90 @@ table_types = {
     ("Energiskatt", "kWh", "Överföring", "Summa"): "elnät",
     ("Medelspotpris", "påslag", "kWh"): "elhandel",
     ("Energiavgift", "MWh"): "fjärrvärme",
-    ("Serviceavgift"): "stadsnät",
+    ("Serviceavgift",): "stadsnät",
 }
+_table_terms = sorted({term for terms in table_types for term in terms})
+# Keywords of the page holding the date heading and the invoice number
+_header_terms = ("FAKTURA", "Faktura")
+_word_re = re.compile(r"\w+")
+
+
+def _table_tokens(table: pd.DataFrame) -> list[str]:
+    """Sorted unique words of the header and cells of a table."""
+    values = itertools.chain(table.columns, table.to_numpy().ravel())
+    return sorted({token for value in values for token in _word_re.findall(str(value))})
+
+
+def _has_token_starting_with(tokens: list[str], term: str) -> bool:
+    idx = bisect.bisect_left(tokens, term)
+    return idx < len(tokens) and tokens[idx].startswith(term)
+
+
+def _is_relevant_page(text: str) -> bool:
+    """Whether the text of a page has the keywords of a table type or of the invoice header."""
+    tokens = sorted(set(_word_re.findall(text)))
+    matched = {term for term in _table_terms if _has_token_starting_with(tokens, term)}
+    return any(matched.issuperset(terms) for terms in table_types) or any(
+        _has_token_starting_with(tokens, term) for term in _header_terms
+    )
+
+
+def needed_pages(source: Path) -> tuple[list[int], int]:
+    """
+    Pre-scan the text layer with pypdf for the pages holding the tables or the invoice header.
+
+    Returns their indexes with the total page count, all pages when no page could be
+    determined, e.g. for scanned invoices without a text layer.
+    """
+    with span("docling select pages", bytes=source.stat().st_size) as record:
+        reader = PdfReader(source.as_posix())
+        pages = [idx for idx, page in enumerate(reader.pages) if _is_relevant_page(page.extract_text() or "")]
+        record["pages"], record["total_pages"] = len(pages), len(reader.pages)
+        return pages or list(range(len(reader.pages))), len(reader.pages)
+
+
+def select_pages(source: Path, pages: list[int] | None = None) -> tuple[BytesIO | None, list[int], int]:
+    """
+    Return a PDF of only the needed pages, or None when all pages are needed, with their indexes and the total page count.
+
+    The pages are determined by `needed_pages` unless given.
+    """
+    if pages is None:
+        pages, total_pages = needed_pages(source)
+    reader = PdfReader(source.as_posix())
+    if len(pages) == len(reader.pages):
+        return None, pages, len(reader.pages)
+    with span("docling write page subset", pages=len(pages)):
+        writer = PdfWriter()
+        for idx in pages:
+            writer.add_page(reader.pages[idx])
+        subset = BytesIO()
+        writer.write(subset)
+        subset.seek(0)
+    return subset, pages, len(reader.pages)
+
+
+def classify_table(table: pd.DataFrame) -> list[TableType]:
+    """Return the table types having all their keywords within the table, as words or word prefixes."""
+    tokens = _table_tokens(table)
+    matched = {term for term in _table_terms if _has_token_starting_with(tokens, term)}
+    return [table_type for terms, table_type in table_types.items() if matched.issuperset(terms)]
 
 
 def _categorize_tables(tables: list[pd.DataFrame]) -> TableTypeDict:
-    """Parse through raw list of Pandas tables and categorize them."""
+    """Parse through raw list of Pandas tables and categorize them, the last table of a type is used."""
     output_tables = {}
-    for table, (terms, table_type) in itertools.product(tables, table_types.items()):
-        text = table.to_string()
-        if all((term in text for term in terms)):
-            output_tables[table_types[terms]] = table
-            ...
+    for idx, table in enumerate(tables):
+        match classify_table(table):
+            case []:
+                logger.debug(f"Table {idx} does not match any table type")
+            case [table_type]:
+                if table_type in output_tables:
+                    logger.warning(f"Table {idx} replaces earlier table of type {table_type}")
+                output_tables[table_type] = table
+            case ambiguous_types:
+                logger.warning(f"Table {idx} matches several table types {ambiguous_types}, using all")
+                output_tables |= dict.fromkeys(ambiguous_types, table)
     return output_tables
 
 
@@ -85,20 +166,61 @@ def _get_data_dict_from_tables(tables: TableTypeDict) -> dict:
     return d
 
 
-def _get_date_and_invoice_number(html_path: Path) -> tuple[str, str]:
-    """Extract date and invoice number from HTML file name."""
-    html = bs4.BeautifulSoup(open(html_path.as_posix()), features="lxml")
+def _pipeline_options(profile: DoclingProfile) -> PdfPipelineOptions:
+    """PDF pipeline options of a profile, the layout and table structure models are always used."""
+    options = PdfPipelineOptions()
+    options.do_ocr = profile.ocr
+    options.do_table_structure = True
+    options.table_structure_options.mode = TableFormerMode(profile.table_mode)
+    accelerator = {"device": AcceleratorDevice(profile.device)}
+    if profile.threads:
+        accelerator["num_threads"] = profile.threads
+    options.accelerator_options = AcceleratorOptions(**accelerator)
+    if not profile.ocr:
+        # Invoices with a text layer need nothing but the text cells and the tables
+        options.do_picture_classification = False
+        options.do_picture_description = False
+        options.do_code_enrichment = False
+        options.do_formula_enrichment = False
+        options.generate_page_images = False
+        options.generate_picture_images = False
+    return options
+
+
+@functools.cache
+def get_converter(profile: DoclingProfile = DoclingProfile()) -> DocumentConverter:
+    """Return the converter of a profile for this process, models are loaded once and kept warm."""
+    logger.info(f"Loading Docling converter {profile}")
+    with span("docling load converter", profile=profile.key):
+        if profile == DoclingProfile():
+            return DocumentConverter()
+        return DocumentConverter(
+            format_options={InputFormat.PDF: PdfFormatOption(pipeline_options=_pipeline_options(profile))}
+        )
+
+
+def _get_date_and_invoice_number_from_document(doc: DoclingDocument) -> tuple[str, str]:
+    """Extract date and invoice number from the headers and paragraphs of a Docling document."""
+    items = [item for item, _ in doc.iterate_items() if isinstance(item, TextItem)]
     date = next(
         (
             e.text.split().pop(0)
-            for e in html.find_all("h2")
-            if e.text.endswith("FAKTURA")
-        )
+            for e in items
+            if isinstance(e, SectionHeaderItem) and e.text.endswith("FAKTURA")
+        ),
+        None,
     )
+    if date is None:
+        # Docling leaves out the heading of some older invoices, the callers fall back to pypdf
+        raise KeyError("No FAKTURA heading with the invoice date in the Docling document")
+    # Same as the <p> elements of the HTML export
+    paragraphs = [
+        e for e in items if e.label in (DocItemLabel.TEXT, DocItemLabel.PARAGRAPH) and not isinstance(e, TitleItem)
+    ]
     invoice_number = next(
         (
-            list(html.find_all("p"))[idx + 1].text
-            for idx, p in enumerate(list(html.find_all("p")))
+            paragraphs[idx + 1].text
+            for idx, p in enumerate(paragraphs)
             if p.text.startswith("Faktura")
         ),
         None,
@@ -106,22 +228,62 @@ def _get_date_and_invoice_number(html_path: Path) -> tuple[str, str]:
     return date, invoice_number
 
 
-def convert_pdf_to_html(source: Path) -> str:
-    converter = DocumentConverter()
-    result = converter.convert(source.as_posix())
-    html = result.document.export_to_html()
-    return html
+def _to_numeric_column(column: pd.Series) -> pd.Series:
+    """Convert column to float the same way pd.read_html does with decimal "," and thousands "."."""
+    values = column.dropna()
+    numbers = pd.to_numeric(
+        values.str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
+        errors="coerce",
+    )
+    if values.empty or numbers.isna().any():
+        return column
+    return numbers.reindex(column.index)
 
 
-def parse_html_to_pl_using_docling(html_path: Path) -> pl.DataFrame:
-    """Parse HTML file to Polars DataFrame."""
-    input_tables = pd.read_html(
-        html_path.as_posix(), decimal=",", thousands=".", header=0
-    )
-    tables = _categorize_tables(input_tables)
+def _table_to_pd(table: TableItem) -> pd.DataFrame:
+    """Convert Docling table to Pandas using first row as header, as pd.read_html on the HTML export."""
+    rows = [[cell.text.strip() or None for cell in row] for row in table.data.grid]
+    if not rows:
+        return pd.DataFrame()
+    columns = []
+    for idx, name in enumerate(rows[0]):
+        name = name or f"Unnamed: {idx}"
+        duplicates = columns.count(name)
+        columns.append(f"{name}.{duplicates}" if duplicates else name)
+    df = pd.DataFrame(rows[1:], columns=columns, dtype=object)
+    return df.apply(_to_numeric_column)
+
+
+def convert_pdf_to_document(
+    source: Path, profile: DoclingProfile = DoclingProfile(), pages: list[int] | None = None
+) -> DoclingDocument:
+    """Convert the pages of the PDF holding the tables and the invoice header, see `select_pages`."""
+    converter = get_converter(profile)
+    subset, pages, total_pages = select_pages(source, pages)
+    if subset is not None:
+        logger.debug(f"Converting {len(pages)} of {total_pages} pages of {source.name}")
+    with span("docling convert", bytes=source.stat().st_size, profile=profile.key, pages=len(pages)):
+        if subset is None:
+            result = converter.convert(source.as_posix())
+        else:
+            result = converter.convert(DocumentStream(name=source.name, stream=subset))
+    return result.document
+
+
+def _tables_to_pl(input_tables: list[pd.DataFrame], date: str, invoice_number: str) -> pl.DataFrame:
+    with span("categorize tables", tables=len(input_tables)):
+        tables = _categorize_tables(input_tables)
     data_dict = _get_data_dict_from_tables(tables)
-    date, invoice_number = _get_date_and_invoice_number(html_path)
     logger.info(f"Date: {date} using Docling")
     return pl.DataFrame(data_dict).with_columns(
         [pl.lit(date).alias("date"), pl.lit(invoice_number).alias("invoice_number")]
     )
+
+
+def parse_document_to_pl_using_docling(doc: DoclingDocument) -> pl.DataFrame:
+    """Parse Docling document to Polars DataFrame."""
+    with span("docling tables to pandas", tables=len(doc.tables)):
+        input_tables = [_table_to_pd(table) for table in doc.tables]
+    with span("docling date and invoice number"):
+        date, invoice_number = _get_date_and_invoice_number_from_document(doc)
+    return _tables_to_pl(input_tables, date, invoice_number)
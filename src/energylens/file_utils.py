@@ -0,0 +1,25 @@
+import contextlib
+import os
+import tempfile
+from collections.abc import Iterator
+from pathlib import Path
+
+
+@contextlib.contextmanager
+def atomic_write(path: Path, mode: int = 0o644) -> Iterator[Path]:
+    """
+    Yield a temporary file next to path to write to, replacing path with it once written.
+
+    A crash never leaves a truncated file at path and the temporary file is removed on errors.
+    The mode is set before anything is written, e.g. 0o600 for files readable by the current user only.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    tmp_path = Path(tmp_name)
+    try:
+        os.chmod(tmp_path, mode)
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
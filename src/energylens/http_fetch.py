@@ -0,0 +1,243 @@
+import asyncio
+import dataclasses
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from energylens.log import logger
+from energylens.manifest import Manifest
+from energylens.timing import timed_step
+
+JsonItems = list[dict]
+
+
+@dataclasses.dataclass
+class InvoiceApi:
+    """
+    Endpoints the web app uses for listing invoices and fetching their PDFs.
+
+    The PDF url template has an {id} placeholder for the value of id_field of a listed invoice,
+    items_path is the path of keys to the list of invoices within the JSON response.
+    """
+
+    list_url: str
+    pdf_url_template: str
+    id_field: str
+    items_path: tuple[str, ...] = ()
+    headers: dict[str, str] = dataclasses.field(default_factory=dict)
+    cookies: list[dict] = dataclasses.field(default_factory=list)
+
+
+def find_items(data, path: tuple[str, ...] = ()) -> tuple[tuple[str, ...], JsonItems] | None:
+    """Return the path and content of the first list of objects within JSON data."""
+    if isinstance(data, list) and data and all(isinstance(item, dict) for item in data):
+        return path, data
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if found := find_items(value, (*path, key)):
+                return found
+    return None
+
+
+class ApiRecorder:
+    """Records the JSON and PDF responses of the web app to discover its invoice endpoints."""
+
+    def __init__(self):
+        self.json_responses: list[tuple[str, object]] = []
+        self.pdf_urls: list[str] = []
+        self.headers: dict[str, str] = {}
+
+    def attach(self, context) -> None:
+        context.on("response", self.on_response)
+
+    async def on_response(self, response) -> None:
+        content_type = response.headers.get("content-type", "")
+        if "application/pdf" in content_type:
+            self.pdf_urls.append(response.url)
+        elif "json" in content_type:
+            try:
+                data = await response.json()
+            except Exception:
+                return
+            self.json_responses.append((response.url, data))
+            if authorization := (await response.request.all_headers()).get("authorization"):
+                self.headers["authorization"] = authorization
+
+    @staticmethod
+    def _id_segment(pdf_url: str, value: str) -> re.Match | None:
+        """The single path segment or query value of the url equal to value, None if absent or ambiguous."""
+        matches = list(re.finditer(rf"(?<=[/=]){re.escape(value)}(?=[/?&#]|$)", pdf_url))
+        return matches[0] if len(matches) == 1 else None
+
+    def discover(self) -> InvoiceApi:
+        """
+        Find the invoice list having an item id that is part of a fetched PDF url.
+
+        The id field must have a different value for each listed invoice, e.g. not a customer
+        number shared by all of them, and the url must contain the id of exactly one invoice.
+        """
+        for pdf_url in self.pdf_urls:
+            for list_url, data in self.json_responses:
+                if not (found := find_items(data)):
+                    continue
+                items_path, items = found
+                for field in items[0]:
+                    values = [str(item.get(field)) for item in items if isinstance(item.get(field), (str, int))]
+                    if len(values) != len(items) or len(set(values)) != len(values) or len(items) < 2:
+                        continue
+                    segments = [(value, m) for value in values if (m := self._id_segment(pdf_url, value))]
+                    if len(segments) != 1:
+                        continue
+                    _, segment = segments[0]
+                    api = InvoiceApi(
+                        list_url=list_url,
+                        pdf_url_template=f"{pdf_url[: segment.start()]}{{id}}{pdf_url[segment.end() :]}",
+                        id_field=field,
+                        items_path=items_path,
+                        headers=dict(self.headers),
+                    )
+                    logger.info(f"Discovered invoice API {api.list_url} -> {api.pdf_url_template}")
+                    return api
+        raise LookupError(
+            f"Could not discover invoice endpoints from {len(self.json_responses)} JSON and "
+            f"{len(self.pdf_urls)} PDF responses, use the browser based download instead"
+        )
+
+
+class InvoiceHttpClient:
+    """Fetches the invoice list and PDFs directly using a pooled HTTP session with the browser's credentials."""
+
+    def __init__(self, api: InvoiceApi, concurrency: int = 4, retries: int = 2, timeout: float = 30):
+        self.api = api
+        self.concurrency = max(concurrency, 1)
+        self.retries = retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_maxsize=self.concurrency,
+            max_retries=Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504)),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(api.headers)
+        for cookie in api.cookies:
+            self.session.cookies.set(
+                cookie["name"], cookie["value"], domain=cookie.get("domain", ""), path=cookie.get("path", "/")
+            )
+
+    def list_invoices(self) -> JsonItems:
+        response = self.session.get(self.api.list_url, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        for key in self.api.items_path:
+            data = data[key]
+        return data
+
+    def fetch_pdf(self, item: dict) -> bytes:
+        url = self.api.pdf_url_template.format(id=item[self.api.id_field])
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def _fetch_to_file(self, download_path: Path, filename: str, item: dict) -> Path:
+        fn = download_path / filename
+        with timed_step("fetch invoice", invoice=item[self.api.id_field]) as step:
+            step["bytes"] = fn.write_bytes(self.fetch_pdf(item))
+        return fn
+
+    def download_invoices(
+        self,
+        download_path: Path,
+        filename_prefix: str = "invoice_",
+        max_invoices: int = 0,
+        incremental: bool = False,
+    ) -> int:
+        """
+        Download the listed invoices concurrently and record them in the manifest of the download path.
+
+        In incremental mode invoices are fetched newest first in rounds of concurrency invoices
+        until one already in the manifest is reached. Invoices failing all retries do not stop
+        the others, they are raised together once the remaining ones are saved. Returns the number
+        of new invoices.
+        """
+        manifest = Manifest(download_path, filename_prefix)
+        with timed_step("list invoices"):
+            items = self.list_invoices()
+        items = items[:max_invoices] if max_invoices else items
+        logger.info(f"Fetching {len(items)} invoices using {self.concurrency} connection(s)")
+        chunk_size = self.concurrency if incremental else len(items)
+        new_invoices = 0
+        failed: dict[int, Exception] = {}
+        # Invoices stored before a failure are kept in the manifest
+        try:
+            with ThreadPoolExecutor(self.concurrency) as executor:
+                for start in range(0, len(items), max(chunk_size, 1)):
+                    futures = {
+                        idx: executor.submit(self._fetch_to_file, download_path, f".{filename_prefix}{idx}.part", item)
+                        for idx, item in enumerate(items[start : start + chunk_size], start)
+                    }
+                    known = []
+                    for idx, future in futures.items():
+                        try:
+                            known.append(manifest.store(future.result())[1])
+                        except Exception as e:
+                            logger.warning(f"Invoice {idx} failed: {e}")
+                            failed[idx] = e
+                    new_invoices += known.count(False)
+                    if incremental and any(known):
+                        logger.info("Reached an invoice already downloaded, stopping")
+                        break
+        finally:
+            manifest.save()
+        if failed:
+            logger.error(f"Failed fetching invoices {sorted(failed)} after {self.retries} retries")
+            raise ExceptionGroup(f"Failed fetching invoices {sorted(failed)}", list(failed.values()))
+        return new_invoices
+
+
+async def discover_invoice_api(scraper) -> InvoiceApi:
+    """
+    Login using the browser of an initialized AsyncScraper and discover the invoice endpoints.
+
+    The invoice list is opened and the first PDF fetched while the traffic is recorded,
+    the recorded endpoints are returned together with the cookies of the session.
+    """
+    recorder = ApiRecorder()
+    recorder.attach(scraper.context)
+    page = await scraper.context.new_page()
+    with timed_step("login"):
+        await scraper.login(page)
+    with timed_step("discover invoice api"):
+        rows = await scraper.open_invoice_list(page)
+        if fn := await scraper.download_invoice(page, rows, set(), 0):
+            fn.unlink()
+    await page.close()
+    api = recorder.discover()
+    api.cookies = await scraper.context.cookies()
+    return api
+
+
+async def download_invoices_over_http(scraper, concurrency: int = 4) -> int:
+    """
+    Use the browser of an AsyncScraper only for the login, then fetch the invoices over HTTP.
+
+    Returns the number of new invoices.
+    """
+    await scraper.async_init()
+    try:
+        api = await discover_invoice_api(scraper)
+    finally:
+        await scraper.close()
+    max_invoices = 0
+    if scraper.limit_invoices:
+        assert scraper.limit_invoices > 1, "Limit must be greater than 1"
+        max_invoices = scraper.limit_invoices - 1
+    client = InvoiceHttpClient(api, concurrency=concurrency, retries=scraper.retries)
+    return await asyncio.to_thread(
+        client.download_invoices,
+        scraper.download_path, scraper.filename_prefix, max_invoices, scraper.incremental
+    )
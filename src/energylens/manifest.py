@@ -0,0 +1,105 @@
+import dataclasses
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+from energylens.file_utils import atomic_write
+from energylens.log import logger
+
+MANIFEST_NAME = "manifest.json"
+
+
+@dataclasses.dataclass
+class ManifestEntry:
+    invoice_number: str | None
+    date: str | None
+    sha256: str
+    filename: str
+
+    @property
+    def key(self) -> str:
+        return self.invoice_number or f"sha256:{self.sha256}"
+
+
+def read_invoice_key(pdf_path: Path) -> tuple[str | None, str | None]:
+    """Return invoice number and date from the text layer of the first page of an invoice."""
+    from pypdf import PdfReader
+
+    from energylens.pypdf_parser import DATE_RULE, INVOICE_NUMBER_RULE
+
+    text = PdfReader(pdf_path.as_posix()).pages[0].extract_text()
+    invoice_number = m.group(1) if (m := re.search(INVOICE_NUMBER_RULE, text)) else None
+    date = m.group(1) if (m := re.search(DATE_RULE, text)) else None
+    return invoice_number, date
+
+
+class Manifest:
+    """
+    Record of the invoices downloaded to a folder, keyed by invoice number.
+
+    Files are named by a stable key (date and invoice number) instead of their
+    position in the invoice list, which shifts every month. Files named by position
+    by earlier versions are renamed when the manifest of their folder is created.
+    """
+
+    def __init__(self, download_path: Path, filename_prefix: str = "invoice_"):
+        self.path = download_path / MANIFEST_NAME
+        self.download_path = download_path
+        self.filename_prefix = filename_prefix
+        self.entries: dict[str, ManifestEntry] = {}
+        if self.path.exists():
+            self.entries = {
+                key: ManifestEntry(**entry) for key, entry in json.loads(self.path.read_text()).items()
+            }
+        else:
+            self._migrate_position_named_files()
+
+    def _migrate_position_named_files(self) -> None:
+        """Rename files named invoice_{idx}.pdf, otherwise they are parsed again next to their renamed copies."""
+        pattern = re.compile(rf"{re.escape(self.filename_prefix)}\d+\.pdf")
+        files = sorted(f for f in self.download_path.glob(f"{self.filename_prefix}*.pdf") if pattern.fullmatch(f.name))
+        if not files:
+            return
+        from pypdf.errors import PyPdfError
+
+        logger.info(f"Renaming {len(files)} invoices named by list position in {self.download_path.as_posix()}")
+        try:
+            for f in files:
+                try:
+                    self.store(f)
+                except PyPdfError as e:
+                    # E.g. a PDF of another vendor in the Downloads folder
+                    logger.warning(f"Skipping {f.name}, not a readable invoice: {e.__class__.__name__} {e}")
+        finally:
+            self.save()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def store(self, downloaded_file: Path) -> tuple[ManifestEntry, bool]:
+        """
+        Move a downloaded PDF to its stable file name and record it.
+
+        Returns the entry and whether the invoice was already known before.
+        """
+        with open(downloaded_file, "rb") as f:
+            sha256 = hashlib.file_digest(f, "sha256").hexdigest()
+        invoice_number, date = read_invoice_key(downloaded_file)
+        stem = f"{date}_{invoice_number}" if invoice_number else sha256[:16]
+        entry = ManifestEntry(invoice_number, date, sha256, f"{self.filename_prefix}{stem}.pdf")
+        known = entry.key in self.entries
+        os.replace(downloaded_file, self.download_path / entry.filename)
+        self.entries[entry.key] = entry
+        logger.info(f"{'Known' if known else 'New'} invoice {entry.key} saved as {entry.filename}")
+        return entry, known
+
+    def save(self) -> None:
+        with atomic_write(self.path) as tmp_path:
+            tmp_path.write_text(
+                json.dumps({key: dataclasses.asdict(entry) for key, entry in self.entries.items()}, indent=2)
+            )
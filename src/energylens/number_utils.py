@@ -1,9 +1,18 @@
-import numpy as np
+import polars as pl
 
 
 def _to_float(s):
     """Convenience method to convert string to float."""
     if isinstance(s, str):
-        return float(np.char.replace(np.char.replace(s, " ", ""), ",", "."))
+        return float(s.replace(" ", "").replace(",", "."))
     else:
         return s
+
+
+def _to_float_expr(expr: pl.Expr) -> pl.Expr:
+    """Columnar version of _to_float for Swedish formatted numbers, e.g. "1 234,56"."""
+    return (
+        expr.str.replace_all(r"\s", "")
+        .str.replace(",", ".", literal=True)
+        .cast(pl.Float64, strict=False)
+    )
@@ -0,0 +1,222 @@
+import functools
+import os
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import polars as pl
+
+from energylens.cache import DocumentStore, ParseCache, file_hash
+from energylens.pypdf_parser import parse_html_to_pl_using_pypdf
+from energylens.log import logger
+from energylens.schema import conform_to_schema
+from energylens.timing import add_spans, collect_spans, enable_profiling, profiling_enabled, span
+from energylens.types import DoclingProfile, Strategy
+from energylens.validation import validate_invoice
+
+PARSER_COLUMN = "parser"
+
+
+def _parse_using_docling(
+    pdf_path: Path, docling: DoclingProfile = DoclingProfile(), convert: bool = True
+) -> pl.DataFrame:
+    """
+    Parse the Docling document of a PDF, converted earlier by the same Docling version and profile if stored.
+
+    Converted documents are stored for re-extraction, without convert only stored documents are used.
+    A stored document lacking pages now needed, e.g. after the page selection rules changed, is
+    converted again, without convert it is not used.
+    """
+    # Docling (and torch) are only imported when needed, the pypdf path never loads them
+    from energylens.docling_parser import convert_pdf_to_document, needed_pages, parse_document_to_pl_using_docling
+
+    documents = DocumentStore(variant=docling.key)
+    key = file_hash(pdf_path)
+    pages, _ = needed_pages(pdf_path)
+    with span("docling load document", file=pdf_path.name):
+        doc = documents.get(key)
+    if doc is not None and (missing := sorted(set(pages) - set(documents.stored_pages(key) or ()))):
+        if convert:
+            logger.info(f"Stored Docling document of {pdf_path.name} lacks pages {missing}, converting again")
+        else:
+            logger.warning(
+                f"Stored Docling document of {pdf_path.name} lacks pages {missing}, "
+                "run parse-invoices to convert it again"
+            )
+        doc = None
+    if doc is None:
+        if not convert:
+            raise KeyError(f"No stored Docling document of {pdf_path.name}")
+        doc = convert_pdf_to_document(pdf_path, docling, pages)
+        documents.put(key, doc, pages)
+    return conform_to_schema(
+        parse_document_to_pl_using_docling(doc).with_columns(pl.lit("docling").alias(PARSER_COLUMN))
+    )
+
+
+def _parse_using_pypdf(pdf_path: Path) -> pl.DataFrame:
+    return conform_to_schema(
+        parse_html_to_pl_using_pypdf(pdf_path).with_columns(pl.lit("pypdf").alias(PARSER_COLUMN))
+    )
+
+
+def parse_invoice(
+    pdf_path: Path,
+    strategy: Strategy = "docling",
+    docling: DoclingProfile = DoclingProfile(),
+    *,
+    convert: bool = True,
+) -> pl.DataFrame:
+    """
+    Parse a single invoice PDF, the parser producing the row is recorded in the parser column.
+    Rows of both parsers are conformed to the output schema.
+
+    The docling strategy uses Docling, falling back to the pypdf/regex parser.
+    The tiered strategy uses the much cheaper pypdf/regex parser and only runs Docling
+    when the result does not pass validation. Docling is run using the given pipeline profile.
+    Without convert only Docling documents stored by earlier runs are used, the others fall back to pypdf.
+    """
+    with span("parse invoice", file=pdf_path.name) as record:
+        record["bytes"] = pdf_path.stat().st_size
+        if strategy == "tiered":
+            invoice_df = _parse_using_pypdf(pdf_path)
+            if not (issues := validate_invoice(invoice_df)):
+                return invoice_df
+            logger.info(f"pypdf result of {pdf_path.name} not valid ({'; '.join(issues)}), using Docling")
+            try:
+                return _parse_using_docling(pdf_path, docling, convert)
+            except (KeyError, IndexError):
+                logger.warning(f"Docling failed parsing {pdf_path.name}, keeping pypdf result")
+                return invoice_df
+        try:
+            return _parse_using_docling(pdf_path, docling, convert)
+        except (KeyError, IndexError) as e:
+            # logger.error(f'Error parsing invoice {pdf_path.as_posix()}: {e.__class__.__name__} {e}')
+            logger.info("Attempt to parse again with different parser")
+            return _parse_using_pypdf(pdf_path)
+
+
+def init_worker(
+    threads: int = 1,
+    profiling: bool = False,
+    docling: DoclingProfile = DoclingProfile(),
+    strategy: Strategy = "docling",
+) -> None:
+    """
+    Limit threads used by torch and warm up the Docling converter of a worker process.
+
+    Only the docling strategy imports torch and warms up the converter, the tiered strategy loads it on demand
+    for the invoices failing validation, most workers never need it.
+    """
+    enable_profiling(profiling)
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    # Torch imported on demand by the other strategies reads its thread count from the variables above
+    if strategy == "docling":
+        try:
+            import torch
+
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+        from energylens.docling_parser import get_converter
+
+        get_converter(docling)
+    logger.info(f"Worker {os.getpid()} ready using {threads} thread(s)")
+
+
+def _parse_invoice_with_spans(
+    pdf_path: Path, strategy: Strategy, docling: DoclingProfile
+) -> tuple[pl.DataFrame, list[dict]]:
+    """Parse an invoice in a worker process, returning the spans recorded by the worker with the row."""
+    return parse_invoice(pdf_path, strategy, docling), collect_spans()
+
+
+def parse_invoices_in_pool(
+    pdf_paths: Iterable[Path],
+    workers: int = 1,
+    *,
+    strategy: Strategy = "docling",
+    docling: DoclingProfile = DoclingProfile(),
+    threads_per_worker: int = 1,
+    max_tasks_per_worker: int | None = None,
+) -> Iterator[pl.DataFrame]:
+    """
+    Parse invoice PDFs, optionally across a pool of worker processes.
+
+    Results are yielded in the same order as the given paths. Workers are replaced
+    after `max_tasks_per_worker` invoices to keep memory of long runs bounded.
+    """
+    pdf_paths = list(pdf_paths)
+    parse = functools.partial(parse_invoice, strategy=strategy, docling=docling)
+    if workers <= 1 or len(pdf_paths) <= 1:
+        yield from map(parse, pdf_paths)
+        return
+    profiling = profiling_enabled()
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(pdf_paths)),
+        initializer=init_worker,
+        initargs=(threads_per_worker, profiling, docling, strategy),
+        max_tasks_per_child=max_tasks_per_worker,
+    ) as executor:
+        if not profiling:
+            yield from executor.map(parse, pdf_paths)
+            return
+        for invoice_df, spans in executor.map(
+            functools.partial(_parse_invoice_with_spans, strategy=strategy, docling=docling), pdf_paths
+        ):
+            add_spans(spans)
+            yield invoice_df
+
+
+def parse_invoice_files(
+    pdf_files: Iterable[Path],
+    cache: ParseCache | None = None,
+    workers: int = 1,
+    *,
+    strategy: Strategy = "docling",
+    docling: DoclingProfile = DoclingProfile(),
+    threads_per_worker: int = 1,
+    max_tasks_per_worker: int | None = None,
+) -> Iterator[pl.DataFrame]:
+    """
+    Parse invoice PDFs yielding their rows in the given order, reading unchanged PDFs from the cache.
+
+    The PDFs not found in the cache are parsed by `parse_invoices_in_pool` and stored in the cache.
+    """
+    pdf_files = list(pdf_files)
+    keys = {f: file_hash(f) for f in pdf_files} if cache else {}
+    pending = [f for f in pdf_files if not cache or keys[f] not in cache]
+    logger.info(f"Parsing {len(pending)} of {len(pdf_files)} invoices using {workers} worker(s)")
+    parsed = parse_invoices_in_pool(
+        pending,
+        workers,
+        strategy=strategy,
+        docling=docling,
+        threads_per_worker=threads_per_worker,
+        max_tasks_per_worker=max_tasks_per_worker,
+    )
+    pending = set(pending)
+    for f in pdf_files:
+        if f in pending:
+            invoice_df = next(parsed)
+            if cache:
+                cache.put(keys[f], invoice_df)
+            logger.info(f"✅ Parsed {f.as_posix()}")
+        else:
+            invoice_df = cache.get(keys[f])
+        yield invoice_df
+
+
+def reextract_invoice_files(
+    pdf_files: Iterable[Path], *, strategy: Strategy = "docling", docling: DoclingProfile = DoclingProfile()
+) -> Iterator[pl.DataFrame]:
+    """
+    Parse invoice PDFs applying the current extraction rules to their stored Docling documents.
+
+    The Docling models are never run, PDFs without stored document or whose document lacks
+    pages now needed are parsed by pypdf as when Docling fails. Rows are not read from nor stored in the parse cache.
+    """
+    for f in pdf_files:
+        yield parse_invoice(f, strategy, docling, convert=False)
+        logger.info(f"✅ Re-extracted {f.as_posix()}")
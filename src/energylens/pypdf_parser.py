@@ -1,3 +1,4 @@
+import dataclasses
 import re
 from pathlib import Path
 
@@ -6,86 +7,192 @@ from pypdf import PdfReader
 import polars as pl
 
 from energylens.log import logger
-from energylens.number_utils import _to_float
+from energylens.number_utils import _to_float, _to_float_expr
+from energylens.timing import span
 
 
 def _pdf_to_text(pdf_file: Path) -> list[str]:
     output_texts = []
-    reader = PdfReader(pdf_file.as_posix())
-    for page in reader.pages:
-        output_texts.append(page.extract_text())
+    with span("pypdf text", bytes=pdf_file.stat().st_size):
+        reader = PdfReader(pdf_file.as_posix())
+        for page in reader.pages:
+            output_texts.append(page.extract_text())
     return output_texts
 
 
+SECTIONS = ("ELNÄT", "ELHANDEL", "FJÄRRVÄRME", "STADSNÄT")
+# Section headings are on a line of their own, unlike e.g. "TOTALT BELOPP ELNÄT" or "ELHANDEL 123,45 kr"
+_section_heading_re = re.compile(rf"(?<!BELOPP )\b({'|'.join(SECTIONS)})\n")
+
+
+@dataclasses.dataclass(frozen=True)
+class Section:
+    name: str
+    start: int
+    end: int
+
+
+def segment_sections(text: str) -> dict[str, Section]:
+    """
+    Split invoice text into its sections in a single pass.
+
+    A section runs from its heading to the heading of the next other section,
+    only the first occurrence of each section is used.
+    """
+    headings = [(m.group(1), m.start()) for m in _section_heading_re.finditer(text)]
+    sections = {}
+    for idx, (name, start) in enumerate(headings):
+        if name in sections:
+            continue
+        end = next((s for n, s in headings[idx + 1 :] if n != name), len(text))
+        sections[name] = Section(name, start, end)
+    return sections
+
+
+def _section_texts(text: str) -> dict[str | None, str]:
+    """Text of each section, the whole text for sections not found and for rules without section."""
+    sections = segment_sections(text)
+    return {None: text} | {
+        name: text[sections[name].start : sections[name].end] if name in sections else text
+        for name in SECTIONS
+    }
+
+
+@dataclasses.dataclass(frozen=True)
+class FieldRule:
+    """
+    Regex alternatives for a column, tried in order and the first group of the first match is used.
+
+    Rules having a section only match within the text of that section, unless the section is not
+    found. Flags are given inline so that the same rules can be used by both re and Polars (Rust regex).
+    """
+
+    patterns: tuple[str, ...] = ()
+    section: str | None = None
+
+
+FIELD_RULES: dict[str, FieldRule] = {
+    "Elnät fast avgift enkeltariff (kr/mån)": FieldRule(
+        (r"(?s)^.+?Fast [Aa]vgift(?: enkeltariff)?.*?(\d+,\d{2})",), "ELNÄT"
+    ),
+    "El förbrukning (kWh)": FieldRule((r"(?i)(\d+(?:,\d{1,3})?) kWh\s",)),
+    "Elnät överföring enkeltariff (öre/kWh)": FieldRule(
+        (r"Överföring(?: enkeltariff)?\s+\d+,\d{2}(\d+,\d{2})",), "ELNÄT"
+    ),
+    "Elnät energiskatt (öre/kWh)": FieldRule(
+        (r"Energiskatt.+\d+,\d{2}(\d+,\d{2})",), "ELNÄT"
+    ),
+    "Elnät totalt belopp (kr)": FieldRule(
+        (r"TOTALT BELOPP ELNÄT.+?(\d+,\d{2})\skr[\s\n]",), "ELNÄT"
+    ),
+    "Elhandel medelspotpris (öre/kWh)": FieldRule(),
+    "Elhandel rörliga kostnader (öre/kWh)": FieldRule(
+        (r"(?:Rörligt månadspris|Elpris).+?\d+,\d{2}(\d+,\d{2})",), "ELHANDEL"
+    ),
+    "Elhandel fasta påslag (öre/kWh)": FieldRule(),
+    "Elhandel fasta avgift (kr/mån)": FieldRule(
+        (
+            r"(?s)ELHANDEL\n.+?fast avgift.+?\d+,\d{2}(\d+,\d{2})",
+            r"(?s)ELHANDEL\n.+?kr/mån.+?Fast avgift.+?\d+,\d{2}(\d+,\d{2})",
+        ),
+        "ELHANDEL",
+    ),
+    "Elhandel totalt belopp (kr)": FieldRule((r"ELHANDEL ([\d\s]+,\d{2}) kr",)),
+    "Fjärrvärme förbrukning (MWh)": FieldRule((r"(\d+,\d{1,3}) MW",), "FJÄRRVÄRME"),
+    "Fjärrvärme fast avgift (kr/år)": FieldRule(
+        (r"(?i)\d+ dgr kr/år krFast [Aa]vgift\s+.+\d+,\d{2}([\d\s]+,\d{2})\n",),
+        "FJÄRRVÄRME",
+    ),
+    "Fjärrvärme energiavgift (kr/MWh)": FieldRule(
+        (r"kr/MWh krEnergiavgift\s+[\d+\s]+,\d{2}(\d+,\d{2})",), "FJÄRRVÄRME"
+    ),
+    "Fjärrvärme totalt belopp (kr)": FieldRule((r"FJÄRRVÄRME ([\d+\s]+,\d{2}) kr",)),
+    "Stadsnät serviceavgift villa (kr/st)": FieldRule(
+        (r"Serviceavgift [Vv]illa.+?\d+,\d{2}(\d+,\d{2})",), "STADSNÄT"
+    ),
+}
+DATE_RULE = r"(\d{4}-\d{2}-\d{2})"
+INVOICE_NUMBER_RULE = r"Faktura-nr: (\d+)"
+
+_compiled_rules = {
+    column: tuple(re.compile(pattern) for pattern in rule.patterns)
+    for column, rule in FIELD_RULES.items()
+}
+_date_re = re.compile(DATE_RULE)
+_invoice_number_re = re.compile(INVOICE_NUMBER_RULE)
+
+
+def _first_match(patterns: tuple[re.Pattern, ...], text: str) -> str | float:
+    for pattern in patterns:
+        if m := pattern.search(text):
+            return m.group(1)
+    return np.nan
+
+
 def _texts_to_pl(text_pages: list[str]) -> pl.DataFrame:
     text = " ".join(text_pages)
-    d = {}
-    d["Elnät fast avgift enkeltariff (kr/mån)"] = re.findall(
-        r"^.+?Fast [Aa]vgift(?: enkeltariff)?.*?(\d+,\d{2})", text, re.DOTALL
-    )
-    d["El förbrukning (kWh)"] = re.findall(
-        r"(\d+(?:,\d{1,3})?) kWh\s", text, re.IGNORECASE
-    )
-    d["Elnät överföring enkeltariff (öre/kWh)"] = re.findall(
-        r"Överföring(?: enkeltariff)?\s+\d+,\d{2}(\d+,\d{2})", text
-    )
-    d["Elnät energiskatt (öre/kWh)"] = re.findall(
-        r"Energiskatt.+\d+,\d{2}(\d+,\d{2})", text
-    )
-    d["Elnät totalt belopp (kr)"] = re.findall(
-        r"TOTALT BELOPP ELNÄT.+?(\d+,\d{2})\skr[\s\n]", text
-    )
-    d["Elhandel medelspotpris (öre/kWh)"] = np.nan
-    d["Elhandel rörliga kostnader (öre/kWh)"] = re.findall(
-        r"(?:Rörligt månadspris|Elpris).+?\d+,\d{2}(\d+,\d{2})", text
-    )
-    d["Elhandel fasta påslag (öre/kWh)"] = np.nan
-    d["Elhandel fasta avgift (kr/mån)"] = re.findall(
-        r"TOTALT BELOPP ELNÄT.+?ELHANDEL\n.+?fast avgift.+?\d+,\d{2}(\d+,\d{2})",
-        text,
-        re.DOTALL,
-    )
-    if not d["Elhandel fasta avgift (kr/mån)"]:
-        d["Elhandel fasta avgift (kr/mån)"] = re.findall(
-            r"TOTALT BELOPP ELNÄT.+?ELHANDEL\n.+?kr/mån.+?Fast avgift.+?\d+,\d{2}(\d+,\d{2})",
-            text,
-            re.DOTALL,
-        )
-    d["Elhandel totalt belopp (kr)"] = re.findall(r"ELHANDEL ([\d\s]+,\d{2}) kr", text)
-    d["Fjärrvärme förbrukning (MWh)"] = re.findall(r"(\d+,\d{1,3}) MW", text)
-    d["Fjärrvärme fast avgift (kr/år)"] = re.findall(
-        r"\d+ dgr kr/år krFast [Aa]vgift\s+.+\d+,\d{2}([\d\s]+,\d{2})\n",
-        text,
-        re.IGNORECASE,
-    )
-    d["Fjärrvärme energiavgift (kr/MWh)"] = re.findall(
-        r"kr/MWh krEnergiavgift\s+[\d+\s]+,\d{2}(\d+,\d{2})", text
-    )
-    d["Fjärrvärme totalt belopp (kr)"] = re.findall(
-        r"FJÄRRVÄRME ([\d+\s]+,\d{2}) kr", text
-    )
-    d["Stadsnät serviceavgift villa (kr/st)"] = re.findall(
-        r"Serviceavgift [Vv]illa.+?\d+,\d{2}(\d+,\d{2})", text
-    )
-    date = da[0] if (da := re.findall(r"\d{4}-\d{2}-\d{2}", text)) else np.nan
+    with span("pypdf regex", bytes=len(text)):
+        section_texts = _section_texts(text)
+        first_items = {
+            column: _to_float(_first_match(patterns, section_texts[FIELD_RULES[column].section]))
+            for column, patterns in _compiled_rules.items()
+        }
+        date = _first_match((_date_re,), text)
+        invoice_number = _first_match((_invoice_number_re,), text)
     logger.info(f"Date: {date} using PyPDF")
-    invoice_number = i[0] if (i := re.findall(r"Faktura-nr: (\d+)", text)) else np.nan
-    first_items = {
-        k: _to_float(next(iter(v), np.nan)) if isinstance(v, list) else v
-        for k, v in d.items()
-    }
-    logger.info(f"{d['Fjärrvärme förbrukning (MWh)']=}")
+    logger.info(f"{first_items['Fjärrvärme förbrukning (MWh)']=}")
     return pl.DataFrame(first_items).with_columns(
         [pl.lit(date).alias("date"), pl.lit(invoice_number).alias("invoice_number")]
     )
 
 
+def batch_texts_to_pl(texts: list[str]) -> pl.DataFrame:
+    """
+    Extract the fields of many invoice texts at once, returning one row per text.
+
+    The texts are split into sections and the rules are then applied with vectorized
+    string operations over the section columns instead of a Python loop per invoice,
+    missing values are NaN as in _texts_to_pl.
+    """
+    section_texts = [_section_texts(text) for text in texts]
+    text_df = pl.DataFrame(
+        {"text": texts} | {name: [t[name] for t in section_texts] for name in SECTIONS},
+        schema={name: pl.String for name in ("text", *SECTIONS)},
+    )
+    columns = [
+        (
+            _to_float_expr(
+                pl.coalesce(
+                    [pl.col(rule.section or "text").str.extract(pattern, 1) for pattern in rule.patterns]
+                )
+            )
+            if rule.patterns
+            else pl.lit(None, dtype=pl.Float64)
+        )
+        .fill_null(np.nan)
+        .alias(column)
+        for column, rule in FIELD_RULES.items()
+    ]
+    text = pl.col("text")
+    return text_df.select(
+        *columns,
+        text.str.extract(DATE_RULE, 1).alias("date"),
+        text.str.extract(INVOICE_NUMBER_RULE, 1).alias("invoice_number"),
+    )
+
+
 def parse_html_to_pl_using_pypdf(html_path: Path) -> pl.DataFrame:
     logger.info(f"Parsing {html_path.as_posix()} using pypdf/regex method")
     text_pages = _pdf_to_text(html_path)
     return _texts_to_pl(text_pages)
 
 
+def parse_pdfs_to_pl_using_pypdf(pdf_paths: list[Path]) -> pl.DataFrame:
+    """Parse many PDFs with a single batch extraction over their text layers."""
+    logger.info(f"Parsing {len(pdf_paths)} PDFs using batch pypdf/regex method")
+    return batch_texts_to_pl([" ".join(_pdf_to_text(pdf_path)) for pdf_path in pdf_paths])
+
+
 if __name__ == "__main__":
     # text_pages = _pdf_to_text(Path('/Users/edo/Downloads/invoice_20.pdf'))
     # df = _texts_to_pl(text_pages)
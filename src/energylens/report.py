@@ -0,0 +1,291 @@
+import dataclasses
+import datetime
+import hashlib
+from collections.abc import Sequence
+from pathlib import Path
+
+import platformdirs
+import polars as pl
+
+from energylens.dataset import PARTITION_COLUMN, UNKNOWN_YEAR
+from energylens.file_utils import atomic_write
+from energylens.log import logger
+from energylens.types import UtilityName
+from .__about__ import __version__
+
+REPORT_CACHE_PATH = platformdirs.user_cache_path("energylens") / "report"
+
+
+@dataclasses.dataclass(frozen=True)
+class Utility:
+    """Cost and usage columns of a utility, the effective price is cost * price_factor / usage."""
+
+    name: UtilityName
+    cost_column: str
+    usage_column: str | None = None
+    price_factor: float = 1.0
+    price_unit: str | None = None
+
+
+UTILITIES = (
+    Utility("elnät", "Elnät totalt belopp (kr)", "El förbrukning (kWh)", 100.0, "öre/kWh"),
+    Utility("elhandel", "Elhandel totalt belopp (kr)", "El förbrukning (kWh)", 100.0, "öre/kWh"),
+    Utility("fjärrvärme", "Fjärrvärme totalt belopp (kr)", "Fjärrvärme förbrukning (MWh)", 1.0, "kr/MWh"),
+    Utility("stadsnät", "Stadsnät serviceavgift villa (kr/st)"),
+)
+UTILITY_DTYPE = pl.Enum([utility.name for utility in UTILITIES])
+_UTILITY_PRICES = pl.DataFrame(
+    {
+        "utility": [utility.name for utility in UTILITIES],
+        "price_factor": [utility.price_factor for utility in UTILITIES],
+        "price_unit": [utility.price_unit for utility in UTILITIES],
+    },
+    schema={"utility": UTILITY_DTYPE, "price_factor": pl.Float64, "price_unit": pl.String},
+)
+
+# Months compared with for the deltas and the outlier flags, read from before the start of the report
+TRAILING_WINDOW = "12mo"
+
+MONTHLY_SCHEMA = pl.Schema(
+    {
+        "month": pl.Date,
+        "utility": UTILITY_DTYPE,
+        "invoices": pl.UInt32,
+        "cost_kr": pl.Float64,
+        "usage": pl.Float64,
+    }
+)
+
+
+def _sum_usage() -> pl.Expr:
+    # Sum of no values is 0, keep null for utilities without usage
+    return pl.when(pl.col("usage").is_not_null().any()).then(pl.col("usage").sum()).alias("usage")
+
+
+def monthly_costs(invoices: pl.LazyFrame) -> pl.LazyFrame:
+    """Sum the cost and usage of each utility per invoice month, invoices without date are left out."""
+    month = pl.col("date").dt.truncate("1mo").alias("month")
+    per_utility = [
+        invoices.select(
+            month,
+            pl.lit(utility.name, dtype=UTILITY_DTYPE).alias("utility"),
+            pl.col(utility.cost_column).cast(pl.Float64).alias("cost_kr"),
+            (pl.col(utility.usage_column) if utility.usage_column else pl.lit(None))
+            .cast(pl.Float64)
+            .alias("usage"),
+        )
+        for utility in UTILITIES
+    ]
+    return (
+        pl.concat(per_utility)
+        .filter(pl.col("month").is_not_null() & pl.col("cost_kr").is_not_null())
+        .group_by("month", "utility")
+        .agg(
+            pl.len().cast(pl.UInt32).alias("invoices"),
+            pl.col("cost_kr").sum(),
+            _sum_usage(),
+        )
+        # Drop the float noise of the Float32 amounts, costs are in öre and usage at most in kWh
+        .with_columns(pl.col("cost_kr").round(2), pl.col("usage").round(3))
+        .select(MONTHLY_SCHEMA.names())
+    )
+
+
+def _with_deltas(monthly: pl.DataFrame) -> pl.DataFrame:
+    """Relative change of the cost and the effective price to the previous month and to the same month last year."""
+    for offset, suffix in (("1mo", "mom"), ("12mo", "yoy")):
+        previous = monthly.select(
+            pl.col("month").dt.offset_by(offset),
+            "utility",
+            pl.col("cost_kr").alias(f"cost_kr_{suffix}_previous"),
+            pl.col("unit_price").alias(f"unit_price_{suffix}_previous"),
+        )
+        monthly = (
+            monthly.join(previous, on=["month", "utility"], how="left")
+            .with_columns(
+                (pl.col(column) / pl.col(f"{column}_{suffix}_previous") - 1).alias(f"{column}_{suffix}")
+                for column in ("cost_kr", "unit_price")
+            )
+            .drop(f"cost_kr_{suffix}_previous", f"unit_price_{suffix}_previous")
+        )
+    return monthly
+
+
+def _with_outliers(monthly: pl.DataFrame, threshold: float) -> pl.DataFrame:
+    """
+    Flag months whose cost or effective price deviates from the trailing months of the utility.
+
+    The z-score is taken against the mean and standard deviation of the previous 12 months,
+    at least 3 of which must have an invoice.
+    """
+    for column in ("cost_kr", "unit_price"):
+        value = pl.col(column)
+        # Rolling windows by month do not support nulls, e.g. the price of utilities without usage
+        z_scores = (
+            monthly.filter(value.is_not_null())
+            .sort("utility", "month")
+            .select(
+                "month",
+                "utility",
+                (
+                    (value - value.rolling_mean_by("month", TRAILING_WINDOW, min_samples=3, closed="left"))
+                    / value.rolling_std_by("month", TRAILING_WINDOW, min_samples=3, closed="left")
+                )
+                .over("utility")
+                .alias(f"{column}_z"),
+            )
+        )
+        monthly = monthly.join(z_scores, on=["month", "utility"], how="left")
+    return monthly.with_columns(
+        (
+            (pl.col("cost_kr_z").abs() > threshold).fill_null(False)
+            | (pl.col("unit_price_z").abs() > threshold).fill_null(False)
+        ).alias("outlier")
+    )
+
+
+def _fingerprint(path: Path) -> str:
+    """Identify the version of a source file and of the aggregation, a mismatch refreshes its aggregates."""
+    stat = path.stat()
+    h = hashlib.sha256(f"{__version__} {stat.st_size} {stat.st_mtime_ns}".encode())
+    h.update(Path(__file__).read_bytes())
+    return h.hexdigest()[:16]
+
+
+class AggregateCache:
+    """
+    On-disk cache of the monthly aggregates of each source file.
+
+    Entries are refreshed when their file changes, so that after new invoices arrive only the
+    rewritten files are scanned again, e.g. the partitions of the current year of a dataset.
+    """
+
+    def __init__(self, cache_path: Path = REPORT_CACHE_PATH):
+        self.path = cache_path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, source: Path) -> Path:
+        return self.path / f"{hashlib.sha256(source.resolve().as_posix().encode()).hexdigest()[:32]}.parquet"
+
+    def get(self, source: Path) -> pl.DataFrame | None:
+        entry = self._entry(source)
+        if entry.exists() and pl.read_parquet_metadata(entry).get("fingerprint") == _fingerprint(source):
+            self.hits += 1
+            return pl.read_parquet(entry)
+        return None
+
+    def put(self, source: Path, monthly: pl.DataFrame) -> None:
+        self.misses += 1
+        with atomic_write(self._entry(source)) as tmp_path:
+            monthly.write_parquet(tmp_path, metadata={"fingerprint": _fingerprint(source)})
+
+    def report(self) -> None:
+        logger.info(f"Report cache: {self.hits} hits, {self.misses} misses ({self.path.as_posix()})")
+
+
+def _scan(path: Path) -> pl.LazyFrame:
+    if path.suffix in (".ipc", ".arrow", ".feather"):
+        return pl.scan_ipc(path, memory_map=True)
+    return pl.scan_parquet(path, hive_partitioning=False)
+
+
+def _partition_year(path: Path) -> int | None:
+    name, _, value = path.parent.name.partition("=")
+    return int(value) if name == PARTITION_COLUMN and value.isdigit() else None
+
+
+def _source_files(source: Path, since: datetime.date | None, end: datetime.date | None) -> list[Path]:
+    """Files of a parsed invoice file or dataset, dataset partitions outside the period are pruned."""
+    if not source.is_dir():
+        return [source]
+    files = []
+    for path in sorted(source.glob(f"{PARTITION_COLUMN}=*/*.parquet")):
+        year = _partition_year(path)
+        if year == UNKNOWN_YEAR or (since and year < since.year) or (end and year > end.year):
+            continue
+        files.append(path)
+    return files
+
+
+def _end_of_month(day: datetime.date) -> datetime.date:
+    return (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+
+
+def _period(date: pl.Expr, since: datetime.date | None, end: datetime.date | None) -> pl.Expr:
+    period = pl.lit(True)
+    if since:
+        period &= date >= since
+    if end:
+        period &= date <= end
+    return period
+
+
+def _monthly_costs_of_files(
+    files: list[Path], since: datetime.date | None, end: datetime.date | None, use_cache: bool
+) -> pl.DataFrame:
+    """
+    Monthly aggregates of the files, from the cache where possible.
+
+    The period is whole months, since is the first day of a month and the month of end is included.
+    Without the cache the period filter is pushed down to the scan, skipping row groups outside of it.
+    Cached aggregates are kept for the whole file and filtered by month instead.
+    """
+    if not use_cache:
+        if not files:
+            return MONTHLY_SCHEMA.to_frame()
+        invoices = pl.concat([_scan(f) for f in files], how="diagonal_relaxed")
+        period = _period(pl.col("date"), since, _end_of_month(end) if end else None)
+        return monthly_costs(invoices.filter(period)).collect()
+    cache = AggregateCache()
+    aggregates = []
+    for f in files:
+        if (monthly := cache.get(f)) is None:
+            monthly = monthly_costs(_scan(f)).collect()
+            cache.put(f, monthly)
+        aggregates.append(monthly)
+    cache.report()
+    return (
+        pl.concat([MONTHLY_SCHEMA.to_frame(), *aggregates])
+        .filter(_period(pl.col("month"), since, end.replace(day=1) if end else None))
+        # Combine the aggregates of files having invoices of the same month
+        .group_by("month", "utility")
+        .agg(pl.col("invoices").sum(), pl.col("cost_kr").sum(), _sum_usage())
+    )
+
+
+def invoice_report(
+    source: Path,
+    *,
+    start: datetime.date | None = None,
+    end: datetime.date | None = None,
+    utilities: Sequence[UtilityName] | None = None,
+    outlier_threshold: float = 3.0,
+    use_cache: bool = True,
+) -> pl.DataFrame:
+    """
+    Monthly costs, usage and effective price per utility of parsed invoices.
+
+    The source is the output of parse-invoices, a parquet or ipc file or a dataset directory.
+    Each month has the relative change of the cost and the effective price (öre/kWh or kr/MWh)
+    to the previous month (mom) and to the same month the year before (yoy), and is flagged as
+    outlier when its cost or price deviates more than the threshold in standard deviations from
+    the previous 12 months. The trailing months needed for this are read from before the start.
+    Months are the months of the invoice dates, the months of start and end are reported in full.
+    """
+    # The trailing window of the outlier flags also covers the previous month and year of the deltas
+    since = (start.replace(day=1) - datetime.timedelta(days=366)).replace(day=1) if start else None
+    files = _source_files(source, since, end)
+    monthly = _monthly_costs_of_files(files, since, end, use_cache)
+    if utilities:
+        monthly = monthly.filter(pl.col("utility").is_in(utilities))
+    monthly = (
+        monthly.join(_UTILITY_PRICES, on="utility", how="left")
+        .with_columns((pl.col("cost_kr") * pl.col("price_factor") / pl.col("usage")).fill_nan(None).alias("unit_price"))
+        .drop("price_factor")
+    )
+    monthly = _with_outliers(_with_deltas(monthly), outlier_threshold)
+    if start:
+        monthly = monthly.filter(pl.col("month") >= start.replace(day=1))
+    return monthly.sort("month", "utility")
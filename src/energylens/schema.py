@@ -0,0 +1,55 @@
+import polars as pl
+
+# Amount columns produced by both the Docling and the pypdf/regex parser
+AMOUNT_COLUMNS = (
+    "El förbrukning (kWh)",
+    "Elnät fast avgift enkeltariff (kr/mån)",
+    "Elnät överföring enkeltariff (öre/kWh)",
+    "Elnät energiskatt (öre/kWh)",
+    "Elnät totalt belopp (kr)",
+    "Elhandel medelspotpris (öre/kWh)",
+    "Elhandel rörliga kostnader (öre/kWh)",
+    "Elhandel fasta påslag (öre/kWh)",
+    "Elhandel fasta avgift (kr/mån)",
+    "Elhandel totalt belopp (kr)",
+    "Fjärrvärme förbrukning (MWh)",
+    "Fjärrvärme fast avgift (kr/år)",
+    "Fjärrvärme energiavgift (kr/MWh)",
+    "Fjärrvärme totalt belopp (kr)",
+    "Stadsnät serviceavgift villa (kr/st)",
+)
+
+# Parsers that may have produced a row, see the parser column
+PARSERS = ("docling", "pypdf")
+
+# Float32 keeps the 2-3 decimals of the amounts exactly enough at half the size of Float64
+OUTPUT_SCHEMA = pl.Schema(
+    {column: pl.Float32 for column in AMOUNT_COLUMNS}
+    | {"date": pl.Date, "invoice_number": pl.Int64, "parser": pl.Enum(PARSERS)}
+)
+
+# Options of every parquet file written, min/max statistics let scans skip row groups and files
+PARQUET_OPTIONS = {"compression": "zstd", "compression_level": 10, "statistics": True}
+
+
+def conform_to_schema(df: pl.DataFrame, schema: pl.Schema = OUTPUT_SCHEMA) -> pl.DataFrame:
+    """
+    Select, cast and order columns according to the schema, missing columns become null.
+
+    Values that cannot be converted, e.g. an unparsable date, become null as well.
+    """
+    columns = []
+    for name, dtype in schema.items():
+        if name not in df.columns:
+            columns.append(pl.lit(None, dtype=dtype).alias(name))
+            continue
+        column = pl.col(name)
+        if df.schema[name].is_float():
+            # The parsers use NaN for missing values
+            column = column.fill_nan(None)
+        elif df.schema[name] == pl.String:
+            column = column.str.strip_chars()
+            if dtype == pl.Date:
+                column = column.str.to_date("%Y-%m-%d", strict=False)
+        columns.append(column.cast(dtype, strict=False))
+    return df.select(columns)
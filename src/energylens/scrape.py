@@ -1,9 +1,20 @@
 from pathlib import Path
 
-from playwright.sync_api import Playwright, expect, sync_playwright
+from playwright.sync_api import Locator, Playwright, expect, sync_playwright
 
-from .types import Common
+from .types import DEFAULT_CUSTOMER_NAME, Common
 from .log import logger
+from .manifest import Manifest
+from .session import SESSION_PATH, SESSION_PROBE_MS, read_session, write_session
+from .timing import timed_step
+
+STEP_TIMEOUT_MS = 30_000  # Max time for a page element or navigation to appear
+SCROLL_IDLE_MS = 2_000  # Scrolling is done when no new rows appeared within this time
+
+
+def invoice_rows(page, customer_name: str = DEFAULT_CUSTOMER_NAME, row_selector: str | None = None) -> Locator:
+    """Locator of the invoice rows of an account, by the customer name shown on each row or by a selector."""
+    return page.locator(row_selector) if row_selector else page.get_by_text(customer_name, exact=True)
 
 
 class Scraper:
@@ -13,6 +24,11 @@ class Scraper:
         login_secs: int = 20,
         limit_invoices: int = 0,
         *,
+        persist_session: bool = False,
+        session_path: Path = SESSION_PATH,
+        incremental: bool = False,
+        customer_name: str = DEFAULT_CUSTOMER_NAME,
+        row_selector: str | None = None,
         common: Common | None = None,
     ):
         """
@@ -24,12 +40,27 @@ class Scraper:
         :type download_path: Path
         :param login_secs: Timeout duration, in seconds, before 2FA expires.
         :type login_secs: int
+        :param persist_session: Store the authenticated session and restore it on later runs.
+        :type persist_session: bool
+        :param incremental: Stop at the first invoice already in the download manifest.
+        :type incremental: bool
+        :param customer_name: Customer name shown on the invoice rows of the account.
+        :type customer_name: str
+        :param row_selector: Selector of the invoice rows, used instead of the customer name.
+        :type row_selector: str | None
         """
         self.limit_invoices = limit_invoices
         self.login_secs = login_secs  # Timeout before 2FA expires
+        self.persist_session = persist_session
+        self.session_path = session_path
+        self.incremental = incremental
+        self.customer_name = customer_name
+        self.row_selector = row_selector
         self.playwright = sync_playwright().start()
         self.browser = self.playwright.firefox.launch(headless=False)
-        self.context = self.browser.new_context()
+        self.context = self.browser.new_context(
+            storage_state=read_session(session_path) if persist_session else None
+        )
         self.login_url = "https://idp.jonkopingenergi.se/Account/BankID?returnUrl=%2Fconnect%2Fauthorize%2Fcallback%3Fclient_id%3Dweb-MinaSidor%26redirect_uri%3Dhttps%253A%252F%252Fminasidor.jonkopingenergi.se%252Fsignin-oidc%26response_type%3Dcode%26scope%3Dopenid%2520offline_access%26type%3Dprivate"
         self.my_account_url = "https://minasidor.jonkopingenergi.se/"
         self.filename_prefix = common.filename_prefix if common else "invoice_"
@@ -37,49 +68,85 @@ class Scraper:
         assert self.download_path.exists(), "Download path does not exist"
 
     @staticmethod
-    def scroll_to_bottom(page):
+    def scroll_to_bottom(page, rows: Locator, idle_ms: int = SCROLL_IDLE_MS):
         """
         Scrolls to the bottom of a web page using keyboard interactions.
 
-        This method simulates pressing the 'End' key to scroll incrementally down
-        the page. The scrolling stops after reaching the maximum number of scrolls
-        or when the required timeout completes for each scroll action.
+        This method simulates pressing the 'End' key until the number of rows stops growing,
+        i.e. no new rows are loaded within the idle timeout after a scroll.
 
         :param page: The page instance representing the browser tab or window.
         :type page: Any
+        :param rows: Locator of the rows being loaded while scrolling.
+        :type rows: Locator
         :return: None
         """
-        _prev_height = -1
-        _max_scrolls = 20
-        _scroll_count = 0
-        while _scroll_count < _max_scrolls:
-            page.keyboard.down("End")
-            page.wait_for_timeout(1000)
-            _scroll_count += 1
-            logger.info(f"scrolling to bottom - {_scroll_count / _max_scrolls:.0%}")
+        count = rows.count()
+        while True:
+            page.keyboard.press("End")
+            try:
+                expect(rows).not_to_have_count(count, timeout=idle_ms)
+            except AssertionError:
+                break
+            count = rows.count()
+            logger.info(f"scrolling to bottom - {count} rows loaded")
 
     @staticmethod
     def scroll_to_top(page):
         """
-        Scrolls to the top of a webpage, ensuring complete scrolling up within a defined
-        limit of attempts. If the limit is reached, the function stops further scrolling.
+        Scrolls to the top of a webpage and waits until the scroll position is reached.
 
         :param page: The page object representing the current webpage to interact with.
         :type page: Page
         :return: None
         """
-        _prev_height = -1
-        _max_scrolls = 20
-        _scroll_count = 0
-        while _scroll_count < _max_scrolls:
-            page.keyboard.down("Home")
-            page.wait_for_timeout(1000)
-            _scroll_count += 1
-            logger.info(f"scrolling to top - {_scroll_count / _max_scrolls:.0%}")
+        page.keyboard.press("Home")
+        page.wait_for_function("() => window.scrollY === 0", timeout=STEP_TIMEOUT_MS)
 
-    @staticmethod
-    def pause(page, time_ms=1000):
-        page.wait_for_timeout(time_ms)
+    def has_valid_session(self, page) -> bool:
+        """Cheap probe whether the restored session still gives access to the account."""
+        page.goto(self.my_account_url)
+        try:
+            expect(page.get_by_role("link", name="Fakturor", exact=True)).to_be_visible(
+                timeout=SESSION_PROBE_MS
+            )
+        except AssertionError:
+            return False
+        return True
+
+    def login(self, page) -> None:
+        """
+        Starts the BankID login and waits until redirected to the account, at most login_secs.
+
+        When sessions are persisted, a still valid stored session is used instead and a new one
+        is stored after a successful BankID login.
+        """
+        if self.persist_session and read_session(self.session_path):
+            if self.has_valid_session(page):
+                logger.info("Restored session is valid, skipping BankID login")
+                return
+            logger.info("Restored session has expired, login using BankID")
+        page.goto(self.login_url)
+        expect(
+            page.get_by_role("button", name="BankID logga BankID med QR-kod")
+        ).to_be_visible(timeout=STEP_TIMEOUT_MS)
+        page.get_by_role("button", name="BankID logga BankID med QR-kod").click()
+        logger.info(
+            f"Waiting for you to login using BankID on your device - {self.login_secs} seconds timeout ..."
+        )
+        page.wait_for_url(f"{self.my_account_url}**", timeout=self.login_secs * 1000)
+        if self.persist_session:
+            write_session(self.context.storage_state(), self.session_path)
+
+    def _load_row(self, page, rows: Locator, row_idx: int) -> bool:
+        """Scroll until the row is loaded, returns False if the list has no such row."""
+        while rows.count() <= row_idx:
+            page.keyboard.press("End")
+            try:
+                expect(rows).not_to_have_count(rows.count(), timeout=SCROLL_IDLE_MS)
+            except AssertionError:
+                return False
+        return True
 
     def download_invoices(self) -> None:
         """
@@ -93,61 +160,80 @@ class Scraper:
         - Downloads all available invoice PDFs iterating through the action buttons.
         - Closes the page after logging out of the user account.
 
+        Instead of fixed pauses each step waits for its condition (redirect, element visible,
+        row count stable) with a timeout, and the duration of each step is logged.
+
+        Downloaded files are named by date and invoice number and recorded in the manifest of
+        the download folder. In incremental mode the newest invoices are downloaded until
+        one already in the manifest is reached.
+
         :param None
         :return: None
         """
+        manifest = Manifest(self.download_path, self.filename_prefix)
         page = self.context.new_page()
-        page.goto(self.login_url)
-        expect(
-            page.get_by_role("button", name="BankID logga BankID med QR-kod")
-        ).to_be_visible()
-        page.get_by_role("button", name="BankID logga BankID med QR-kod").click()
-        for time_elapsed in range(self.login_secs):
-            logger.info(
-                f"Waiting for you to login using BankID on your device - {self.login_secs - time_elapsed} seconds left ..."
-            )
-            self.pause(page)
-        page.goto(self.my_account_url)
-        expect(page.get_by_role("link", name="Fakturor", exact=True)).to_be_visible()
-        page.get_by_role("link", name="Fakturor", exact=True).click()
-        self.pause(page, 10000)
-        page.get_by_text("Daniel Engvall", exact=True).all()[1].click()
-        self.pause(page)
-        page.get_by_text("Daniel Engvall", exact=True).all()[1].click()
-        self.pause(page)
-        self.scroll_to_bottom(page)
-        all_rows = page.get_by_text("Daniel Engvall", exact=True).all()
-        self.scroll_to_top(page)
+        page.set_default_timeout(STEP_TIMEOUT_MS)
+        with timed_step("login"):
+            self.login(page)
+        with timed_step("open invoices"):
+            page.goto(self.my_account_url)
+            expect(page.get_by_role("link", name="Fakturor", exact=True)).to_be_visible(timeout=STEP_TIMEOUT_MS)
+            page.get_by_role("link", name="Fakturor", exact=True).click()
+            rows = invoice_rows(page, self.customer_name, self.row_selector)
+            expect(rows.nth(1)).to_be_visible(timeout=STEP_TIMEOUT_MS)
+            rows.nth(1).click()
+            page.wait_for_load_state("networkidle")
+            rows.nth(1).click()
+            page.wait_for_load_state("networkidle")
+        if not self.incremental:
+            with timed_step("list invoices"):
+                self.scroll_to_bottom(page, rows)
+                self.scroll_to_top(page)
         if self.limit_invoices:
             assert self.limit_invoices > 1, "Limit must be greater than 1"
-            process_rows = all_rows[1 : self.limit_invoices]
-        else:
-            process_rows = all_rows[1:]
-        for idx, r in enumerate(process_rows):
-            logger.info(f"clicking on row {idx} of {len(all_rows)}")
-            r.click()
-            self.pause(page)
-            all_pdf_buttons = page.get_by_text("Visa PDF-faktura", exact=True).all()
-            logger.info(
-                f"Currently {len(all_pdf_buttons)} expanded, clicking on idx {idx}"
-            )
-            try:
-                pdf_button = all_pdf_buttons[idx]
-            except IndexError:
-                logger.info(f"No more PDFs to download, exiting")
-                break
-            with page.expect_download() as download_info:
-                pdf_button.scroll_into_view_if_needed()
-                pdf_button.click()
-            download = download_info.value
-            fn = self.download_path / f"{self.filename_prefix}{idx}.pdf"
-            download.save_as(fn.as_posix())
-            self.pause(page)
+        pdf_buttons = page.get_by_text("Visa PDF-faktura", exact=True)
+        # Invoices stored before a failure are kept in the manifest
+        try:
+            idx = 0
+            while not self.limit_invoices or idx < self.limit_invoices - 1:
+                if not self._load_row(page, rows, idx + 1):
+                    break
+                with timed_step("download invoice", invoice=idx) as step:
+                    logger.info(f"clicking on row {idx} of {rows.count() - 1}")
+                    rows.nth(idx + 1).click()
+                    try:
+                        expect(pdf_buttons.nth(idx)).to_be_visible(timeout=STEP_TIMEOUT_MS)
+                    except AssertionError:
+                        logger.info(f"No more PDFs to download, exiting")
+                        break
+                    pdf_button = pdf_buttons.nth(idx)
+                    logger.info(
+                        f"Currently {pdf_buttons.count()} expanded, clicking on idx {idx}"
+                    )
+                    with page.expect_download() as download_info:
+                        pdf_button.scroll_into_view_if_needed()
+                        pdf_button.click()
+                    download = download_info.value
+                    fn = self.download_path / f".{self.filename_prefix}{idx}.part"
+                    download.save_as(fn.as_posix())
+                    step["bytes"] = fn.stat().st_size
+                    _, known = manifest.store(fn)
+                if known and self.incremental:
+                    logger.info("Reached an invoice already downloaded, stopping")
+                    break
+                idx += 1
+        finally:
+            manifest.save()
         logger.info("Done")
-        page.get_by_role("button", name="Öppna profil").click()
-        self.pause(page)
-        page.get_by_role("button", name="Logga ut").click()
-        self.pause(page)
+        if self.persist_session:
+            # Logging out would invalidate the stored session
+            write_session(self.context.storage_state(), self.session_path)
+        else:
+            with timed_step("logout"):
+                page.get_by_role("button", name="Öppna profil").click()
+                expect(page.get_by_role("button", name="Logga ut")).to_be_visible(timeout=STEP_TIMEOUT_MS)
+                page.get_by_role("button", name="Logga ut").click()
+                page.wait_for_load_state("networkidle")
         page.close()
 
     def close(self):
@@ -0,0 +1,34 @@
+import json
+from pathlib import Path
+
+import platformdirs
+
+from energylens.file_utils import atomic_write
+from energylens.log import logger
+
+SESSION_PATH = platformdirs.user_data_path("energylens") / "storage_state.json"
+SESSION_PROBE_MS = 5_000  # Time for the account page to show up when the session is still valid
+
+
+def read_session(path: Path = SESSION_PATH) -> dict | None:
+    """Return the stored browser storage state (cookies and tokens) if any."""
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text())
+    except json.JSONDecodeError:
+        logger.warning(f"Ignoring corrupt session file {path.as_posix()}")
+        return None
+
+
+def write_session(state: dict, path: Path = SESSION_PATH) -> None:
+    """
+    Store the browser storage state readable by the current user only.
+
+    A folder created for it is private as well, the permissions of an existing folder are left as they are.
+    """
+    if not path.parent.exists():
+        path.parent.mkdir(parents=True, mode=0o700)
+    with atomic_write(path, mode=0o600) as tmp_path:
+        tmp_path.write_text(json.dumps(state))
+    logger.info(f"Session stored to {path.as_posix()}")
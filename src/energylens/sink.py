@@ -0,0 +1,98 @@
+import shutil
+from pathlib import Path
+
+import polars as pl
+
+from energylens.dataset import upsert_dataset
+from energylens.log import logger
+from energylens.schema import OUTPUT_SCHEMA, PARQUET_OPTIONS, conform_to_schema
+from energylens.types import OutputFormat
+
+
+class InvoiceWriter:
+    """
+    Streams parsed invoices to the output file in small batches.
+
+    Rows are conformed to a fixed schema and written as soon as a batch is complete,
+    keeping memory flat and preserving progress if the run is interrupted.
+    CSV batches are appended directly to the output file, parquet and ipc batches are written
+    as part files next to the output and combined into the output file on close.
+    The dataset format treats the output as a directory partitioned by year and
+    upserts the rows by invoice number on close.
+    """
+
+    def __init__(self, output_file: Path, output_format: OutputFormat = "parquet", batch_size: int = 20):
+        self.output_file = output_file
+        self.output_format = output_format
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self._batch: list[pl.DataFrame] = []
+        self._parts = 0
+        self.parts_path = output_file.parent / f".{output_file.name}.parts"
+        self._csv_file = None
+        match output_format:
+            case "parquet" | "ipc" | "dataset":
+                shutil.rmtree(self.parts_path, ignore_errors=True)
+                self.parts_path.mkdir(parents=True)
+            case "csv":
+                self._csv_file = open(output_file, "w", newline="")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.flush()
+            if self._csv_file:
+                self._csv_file.close()
+            logger.warning(
+                f"Aborted after {self.rows_written} rows, partial output kept in "
+                f"{(self.output_file if self.output_format == 'csv' else self.parts_path).as_posix()}"
+            )
+
+    def write(self, df: pl.DataFrame) -> None:
+        self._batch.append(conform_to_schema(df))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._batch:
+            return
+        batch_df = pl.concat(self._batch)
+        match self.output_format:
+            case "parquet" | "ipc" | "dataset":
+                # Parts are only read back once, compressing them is not worth it
+                batch_df.write_parquet(self.parts_path / f"part-{self._parts:05d}.parquet", compression="lz4")
+            case "csv":
+                batch_df.write_csv(self._csv_file, include_header=self.rows_written == 0)
+                self._csv_file.flush()
+        self._parts += 1
+        self.rows_written += batch_df.height
+        self._batch = []
+
+    def close(self) -> None:
+        self.flush()
+        match self.output_format:
+            case "parquet":
+                if self._parts:
+                    pl.scan_parquet(self.parts_path / "*.parquet").sink_parquet(self.output_file, **PARQUET_OPTIONS)
+                else:
+                    OUTPUT_SCHEMA.to_frame().write_parquet(self.output_file, **PARQUET_OPTIONS)
+                shutil.rmtree(self.parts_path)
+            case "ipc":
+                # Uncompressed so that readers can memory-map the columns, e.g. pl.read_ipc(memory_map=True)
+                if self._parts:
+                    pl.scan_parquet(self.parts_path / "*.parquet").sink_ipc(self.output_file, compression="uncompressed")
+                else:
+                    OUTPUT_SCHEMA.to_frame().write_ipc(self.output_file, compression="uncompressed")
+                shutil.rmtree(self.parts_path)
+            case "dataset":
+                if self._parts:
+                    upsert_dataset(pl.read_parquet(self.parts_path / "*.parquet"), self.output_file)
+                shutil.rmtree(self.parts_path)
+            case "csv":
+                if not self.rows_written:
+                    OUTPUT_SCHEMA.to_frame().write_csv(self._csv_file)
+                self._csv_file.close()
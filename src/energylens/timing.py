@@ -0,0 +1,136 @@
+import contextlib
+import json
+import os
+import time
+from pathlib import Path
+
+from energylens.log import logger
+
+# Spans recorded by this process while profiling, None when profiling is off
+_spans: list[dict] | None = None
+_page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_bytes() -> int:
+    """Resident set size of this process, 0 where /proc is not available."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _page_size
+    except OSError:
+        return 0
+
+
+def enable_profiling(enabled: bool = True) -> None:
+    global _spans
+    if not enabled:
+        _spans = None
+    elif _spans is None:
+        _spans = []
+
+
+def profiling_enabled() -> bool:
+    return _spans is not None
+
+
+def collect_spans() -> list[dict]:
+    """Return and clear the spans recorded so far, e.g. to hand them from a worker to its parent."""
+    if _spans is None:
+        return []
+    spans = _spans[:]
+    _spans.clear()
+    return spans
+
+
+def add_spans(spans: list[dict]) -> None:
+    """Add spans recorded by another process."""
+    if _spans is not None:
+        _spans.extend(spans)
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """
+    Record duration, RSS delta and attributes of a stage while profiling.
+
+    The yielded dict may be updated within the span, e.g. with the number of bytes processed.
+    When profiling is off nothing is measured or recorded.
+    """
+    record = {"bytes": 0} | attrs
+    if _spans is None:
+        yield record
+        return
+    # Wall-clock start time is comparable between the processes of a run
+    started, start, rss = time.time(), time.perf_counter(), _rss_bytes()
+    try:
+        yield record
+    finally:
+        end = time.perf_counter()
+        _spans.append(
+            {
+                "name": name,
+                "start": round(started, 6),
+                "duration": round(end - start, 6),
+                "rss_delta": _rss_bytes() - rss,
+                "pid": os.getpid(),
+            }
+            | record
+        )
+
+
+@contextlib.contextmanager
+def timed_step(name: str, **attrs):
+    """Log the wall-clock duration of a step, making slow or regressing steps visible."""
+    start = time.perf_counter()
+    try:
+        with span(name, **attrs) as record:
+            yield record
+    finally:
+        details = "".join(f" {value}" for value in attrs.values())
+        logger.info(f"⏱ {name}{details} took {time.perf_counter() - start:.2f}s")
+
+
+def summarize_spans(spans: list[dict]) -> list[dict]:
+    """Count, total and mean duration, bytes and RSS delta per span name, slowest first."""
+    summary = {}
+    for s in spans:
+        entry = summary.setdefault(s["name"], {"name": s["name"], "count": 0, "total": 0.0, "bytes": 0, "rss_delta": 0})
+        entry["count"] += 1
+        entry["total"] += s["duration"]
+        entry["bytes"] += s["bytes"]
+        entry["rss_delta"] += s["rss_delta"]
+    return sorted(
+        ({**entry, "mean": entry["total"] / entry["count"]} for entry in summary.values()),
+        key=lambda entry: entry["total"],
+        reverse=True,
+    )
+
+
+def _format_summary(summary: list[dict]) -> str:
+    lines = [f"{'span':<32} {'count':>6} {'total s':>9} {'mean ms':>9} {'MB':>8} {'RSS Δ MB':>9}"]
+    lines += [
+        f"{e['name'][:32]:<32} {e['count']:>6} {e['total']:>9.2f} {e['mean'] * 1000:>9.1f} "
+        f"{e['bytes'] / 2**20:>8.2f} {e['rss_delta'] / 2**20:>9.2f}"
+        for e in summary
+    ]
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def profiling(trace_path: Path | None):
+    """
+    Profile the enclosed run when a trace path is given.
+
+    The spans are written to the trace path as JSON and summarised in a table at the end of the run.
+    """
+    if trace_path is None:
+        yield
+        return
+    enable_profiling()
+    try:
+        yield
+    finally:
+        spans = collect_spans()
+        enable_profiling(False)
+        summary = summarize_spans(spans)
+        trace_path.write_text(json.dumps({"spans": spans, "summary": summary}, indent=1, ensure_ascii=False))
+        logger.info(f"Profile written to {trace_path.as_posix()}\n{_format_summary(summary)}")
@@ -1,9 +1,53 @@
 import dataclasses
+from pathlib import Path
+from typing import Annotated, Literal
 
 from cyclopts import Parameter
 
+# ipc: uncompressed Arrow IPC (Feather v2) file, memory-mappable for zero-copy reads
+OutputFormat = Literal["parquet", "ipc", "csv", "dataset"]
+# docling: Docling first with pypdf/regex as fallback, tiered: pypdf/regex first with Docling for invalid results
+Strategy = Literal["docling", "tiered"]
+# Form of the invoices returned by the API: in-memory frames or serialized bytes
+ResultFormat = Literal["polars", "arrow", "ipc", "parquet"]
+# default: the Docling defaults, fast: no OCR for invoices having a text layer, table structure only
+DoclingPreset = Literal["default", "fast"]
+TableMode = Literal["accurate", "fast"]
+Device = Literal["auto", "cpu", "cuda", "mps"]
+# Shown on each invoice row of the account, the rows of other accounts need their own name or a selector
+DEFAULT_CUSTOMER_NAME = "Daniel Engvall"
+# Utilities of the invoices reported on by the report command
+UtilityName = Literal["elnät", "elhandel", "fjärrvärme", "stadsnät"]
+
+
+@dataclasses.dataclass(frozen=True)
+class DoclingProfile:
+    """Options of the Docling PDF pipeline, the defaults are those of Docling."""
+
+    ocr: bool = True
+    table_mode: TableMode = "accurate"
+    threads: int | None = None  # None uses OMP_NUM_THREADS or the Docling default
+    device: Device = "auto"
+
+    @classmethod
+    def preset(
+        cls, name: DoclingPreset, table_mode: TableMode | None = None, threads: int | None = None, device: Device = "auto"
+    ) -> "DoclingProfile":
+        """Profile of a preset with optional overrides of the table mode and accelerator."""
+        profile = cls(ocr=name != "fast", threads=threads, device=device)
+        return dataclasses.replace(profile, table_mode=table_mode) if table_mode else profile
+
+    @property
+    def key(self) -> str:
+        """Options affecting the extracted rows, threads and device only affect speed."""
+        return f"{'ocr' if self.ocr else 'noocr'}-{self.table_mode}"
+
 
 @Parameter(name="*")
 @dataclasses.dataclass
 class Common:
     filename_prefix: str = "invoice_"
+    profile: Annotated[
+        Path | None,
+        Parameter(help="Write a JSON trace of the duration, bytes and memory of each stage to this file."),
+    ] = None
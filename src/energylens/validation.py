@@ -0,0 +1,74 @@
+import datetime
+import math
+
+import polars as pl
+
+# Columns every electricity invoice is expected to have
+REQUIRED_COLUMNS = (
+    "El förbrukning (kWh)",
+    "Elnät överföring enkeltariff (öre/kWh)",
+    "Elnät energiskatt (öre/kWh)",
+    "Elnät totalt belopp (kr)",
+    "Elhandel totalt belopp (kr)",
+)
+# Columns expected when the invoice has a district heating part
+FJARRVARME_COLUMNS = (
+    "Fjärrvärme förbrukning (MWh)",
+    "Fjärrvärme energiavgift (kr/MWh)",
+    "Fjärrvärme totalt belopp (kr)",
+)
+VAT = 0.25
+TOLERANCE = 0.1
+
+
+def _missing(value) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _totals_match(total: float, items: float) -> bool:
+    """Totals may be including VAT while the line items are not, allow for both."""
+    if _missing(total) or _missing(items) or items <= 0:
+        return True
+    return 1 - TOLERANCE <= total / items <= 1 + VAT + TOLERANCE
+
+
+def validate_invoice(df: pl.DataFrame) -> list[str]:
+    """
+    Check a parsed invoice row for completeness and consistency.
+
+    Returns a list of issues found, an empty list means the row is considered valid.
+    """
+    row = df.row(0, named=True)
+    issues = []
+    # Unparsable dates and invoice numbers are null in rows conformed to the output schema
+    date = row.get("date")
+    if not isinstance(date, datetime.date):
+        issues.append(f"date not parsable: {date!r}")
+    invoice_number = row.get("invoice_number")
+    if not isinstance(invoice_number, int):
+        issues.append(f"invoice number missing: {invoice_number!r}")
+    required = list(REQUIRED_COLUMNS)
+    if not _missing(row.get("Fjärrvärme totalt belopp (kr)")):
+        required += FJARRVARME_COLUMNS
+    issues += [f"{column} missing" for column in required if _missing(row.get(column))]
+    issues += [
+        f"{column} negative"
+        for column, value in row.items()
+        if isinstance(value, float) and value < 0
+    ]
+
+    def get(column: str) -> float:
+        value = row.get(column)
+        return math.nan if _missing(value) else value
+
+    elnat_items = get("Elnät fast avgift enkeltariff (kr/mån)") + get("El förbrukning (kWh)") * (
+        get("Elnät överföring enkeltariff (öre/kWh)") + get("Elnät energiskatt (öre/kWh)")
+    ) / 100
+    if not _totals_match(get("Elnät totalt belopp (kr)"), elnat_items):
+        issues.append("Elnät total does not match line items")
+    fjarrvarme_items = get("Fjärrvärme fast avgift (kr/år)") / 12 + get(
+        "Fjärrvärme förbrukning (MWh)"
+    ) * get("Fjärrvärme energiavgift (kr/MWh)")
+    if not _totals_match(get("Fjärrvärme totalt belopp (kr)"), fjarrvarme_items):
+        issues.append("Fjärrvärme total does not match line items")
+    return issues
@@ -0,0 +1,83 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import polars as pl
+
+from energylens.dataset import PARTITION_COLUMN, UNKNOWN_YEAR, partition_file, scan_dataset, upsert_dataset
+from energylens.schema import conform_to_schema
+
+
+def invoices(*rows: tuple[int | None, str | None, float]) -> pl.DataFrame:
+    """Invoice rows of the output schema from invoice number, date and electricity usage."""
+    numbers, dates, usage = zip(*rows)
+    return conform_to_schema(
+        pl.DataFrame(
+            {"invoice_number": list(numbers), "date": list(dates), "El förbrukning (kWh)": list(usage)},
+            schema={"invoice_number": pl.Int64, "date": pl.String, "El förbrukning (kWh)": pl.Float64},
+        )
+    )
+
+
+class UpsertDatasetTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name) / "dataset"
+
+    def dataset(self) -> pl.DataFrame:
+        return scan_dataset(self.root).collect().sort("invoice_number", "date", nulls_last=True)
+
+    def years(self) -> list[int]:
+        return sorted(int(path.name.partition("=")[2]) for path in self.root.glob(f"{PARTITION_COLUMN}=*"))
+
+    def test_same_rows_twice_leave_partitions_untouched(self):
+        rows = invoices((1001, "2023-05-02", 100.0), (1002, "2024-01-03", 200.0))
+        self.assertEqual(len(upsert_dataset(rows, self.root)), 2)
+        mtimes = {path: path.stat().st_mtime_ns for path in self.root.rglob("*.parquet")}
+
+        self.assertEqual(upsert_dataset(rows, self.root), [])
+        self.assertEqual({path: path.stat().st_mtime_ns for path in self.root.rglob("*.parquet")}, mtimes)
+        self.assertEqual(self.dataset().height, 2)
+
+    def test_updated_row_replaces_the_row_of_its_key(self):
+        upsert_dataset(invoices((1001, "2023-05-02", 100.0), (1002, "2023-06-02", 200.0)), self.root)
+        self.assertEqual(upsert_dataset(invoices((1001, "2023-05-02", 150.0)), self.root), [partition_file(self.root, 2023)])
+        self.assertEqual(self.dataset()["El förbrukning (kWh)"].to_list(), [150.0, 200.0])
+
+    def test_key_moving_to_another_year_leaves_its_old_partition(self):
+        upsert_dataset(invoices((1001, "2023-12-28", 100.0), (1002, "2023-11-28", 200.0)), self.root)
+
+        written = upsert_dataset(invoices((1001, "2024-01-03", 100.0)), self.root)
+        self.assertEqual(written, [partition_file(self.root, 2023), partition_file(self.root, 2024)])
+        self.assertEqual(self.years(), [2023, 2024])
+        self.assertEqual(self.dataset()["invoice_number"].to_list(), [1001, 1002])
+        self.assertEqual(self.dataset()[PARTITION_COLUMN].to_list(), [2024, 2023])
+
+        # The old partition is removed once it has no rows left
+        upsert_dataset(invoices((1002, "2024-02-03", 200.0)), self.root)
+        self.assertEqual(self.years(), [2024])
+        self.assertEqual(self.dataset()["invoice_number"].to_list(), [1001, 1002])
+
+    def test_key_leaving_the_partition_of_unknown_dates(self):
+        upsert_dataset(invoices((1001, None, 100.0)), self.root)
+        self.assertEqual(self.years(), [UNKNOWN_YEAR])
+
+        upsert_dataset(invoices((1001, "2024-01-03", 100.0)), self.root)
+        self.assertEqual(self.years(), [2024])
+        self.assertEqual(self.dataset().height, 1)
+
+    def test_rows_without_key_are_deduplicated_on_all_columns(self):
+        rows = invoices((None, "2024-01-03", 100.0), (None, "2024-01-03", 100.0), (None, "2024-02-03", 200.0))
+        upsert_dataset(rows, self.root)
+        self.assertEqual(self.dataset()["El förbrukning (kWh)"].to_list(), [100.0, 200.0])
+
+        # Rows without key never replace other rows, identical ones are not added again
+        self.assertEqual(upsert_dataset(rows, self.root), [])
+        upsert_dataset(invoices((None, "2024-01-03", 150.0), (1001, "2024-01-03", 100.0)), self.root)
+        self.assertEqual(self.dataset()["invoice_number"].null_count(), 3)
+        self.assertEqual(self.dataset().height, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import stat
+import tempfile
+import unittest
+from pathlib import Path
+
+from energylens.file_utils import atomic_write
+from energylens.session import read_session, write_session
+
+
+class AtomicWriteTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "file.json"
+
+    def test_file_is_replaced_once_written(self):
+        self.path.write_text("old")
+        with atomic_write(self.path) as tmp_path:
+            tmp_path.write_text("new")
+            self.assertEqual(self.path.read_text(), "old")
+        self.assertEqual(self.path.read_text(), "new")
+        self.assertEqual(list(self.path.parent.iterdir()), [self.path])
+
+    def test_failed_write_leaves_the_file_untouched(self):
+        self.path.write_text("old")
+        with self.assertRaises(ValueError), atomic_write(self.path) as tmp_path:
+            tmp_path.write_text("partial")
+            raise ValueError
+        self.assertEqual(self.path.read_text(), "old")
+        self.assertEqual(list(self.path.parent.iterdir()), [self.path])
+
+    def test_session_is_readable_by_the_current_user_only(self):
+        write_session({"cookies": []}, self.path)
+        self.assertEqual(stat.S_IMODE(self.path.stat().st_mode), 0o600)
+        self.assertEqual(read_session(self.path), {"cookies": []})
+
+
+if __name__ == "__main__":
+    unittest.main()
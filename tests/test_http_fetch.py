@@ -0,0 +1,134 @@
+import json
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from energylens.http_fetch import ApiRecorder, InvoiceHttpClient
+from energylens.manifest import Manifest
+
+sys.path.insert(0, (Path(__file__).parents[1] / "benchmarks").as_posix())
+from corpus import generate_corpus  # noqa: E402
+
+CUSTOMER_NUMBER = "556677"
+
+
+class InvoiceServer(ThreadingHTTPServer):
+    """Web app stand-in listing invoices of one customer newest first and serving their PDFs."""
+
+    def __init__(self, pdfs: dict[str, bytes]):
+        super().__init__(("127.0.0.1", 0), InvoiceHandler)
+        self.pdfs = pdfs
+        self.order = list(pdfs)
+        self.pdf_requests: list[str] = []
+        self.failing: set[str] = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def pdf_path(self, invoice_id: str) -> str:
+        return f"/customers/{CUSTOMER_NUMBER}/invoices/{invoice_id}/pdf"
+
+
+class InvoiceHandler(BaseHTTPRequestHandler):
+    server: InvoiceServer
+
+    def do_GET(self):
+        if self.path == "/api/invoices":
+            items = [{"customerNumber": CUSTOMER_NUMBER, "invoiceId": i} for i in self.server.order]
+            self._send("application/json", json.dumps({"data": {"invoices": items}}).encode())
+        elif (invoice_id := self.path.split("/")[4]) in self.server.failing:
+            self.send_error(500)
+        elif invoice_id in self.server.pdfs:
+            self.server.pdf_requests.append(invoice_id)
+            self._send("application/pdf", self.server.pdfs[invoice_id])
+        else:
+            self.send_error(404)
+
+    def _send(self, content_type: str, body: bytes) -> None:
+        self.send_response(200)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpFetchTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp_path = Path(tmp.name)
+        corpus_path = self.tmp_path / "corpus"
+        generate_corpus(corpus_path, 4)
+        pdfs = {f"9000{i}": fn.read_bytes() for i, fn in enumerate(sorted(corpus_path.glob("*.pdf")))}
+        self.server = InvoiceServer(pdfs)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def recorder(self, pdf_id: str) -> ApiRecorder:
+        recorder = ApiRecorder()
+        recorder.json_responses.append((f"{self.server.url}/api/other", {"items": [{"id": 1}]}))
+        recorder.json_responses.append(
+            (
+                f"{self.server.url}/api/invoices",
+                {"data": {"invoices": [{"customerNumber": CUSTOMER_NUMBER, "invoiceId": i} for i in self.server.order]}},
+            )
+        )
+        recorder.pdf_urls.append(f"{self.server.url}{self.server.pdf_path(pdf_id)}")
+        return recorder
+
+    def test_discover_uses_the_field_unique_to_the_fetched_invoice(self):
+        api = self.recorder("90001").discover()
+        self.assertEqual(api.id_field, "invoiceId")
+        self.assertEqual(api.items_path, ("data", "invoices"))
+        self.assertEqual(api.pdf_url_template, f"{self.server.url}/customers/{CUSTOMER_NUMBER}/invoices/{{id}}/pdf")
+
+    def test_discover_fails_without_a_unique_field(self):
+        recorder = self.recorder("90001")
+        recorder.pdf_urls = [f"{self.server.url}/customers/{CUSTOMER_NUMBER}/latest.pdf"]
+        with self.assertRaises(LookupError):
+            recorder.discover()
+
+    def test_download_invoices_and_incremental_rerun(self):
+        download_path = self.tmp_path / "invoices"
+        download_path.mkdir()
+        newest = self.server.order.pop(0)
+        client = InvoiceHttpClient(self.recorder("90001").discover(), concurrency=2)
+
+        self.assertEqual(client.download_invoices(download_path), 3)
+        self.assertEqual(len(Manifest(download_path)), 3)
+        self.assertEqual(len(list(download_path.glob("invoice_*.pdf"))), 3)
+
+        # A new invoice is listed first, the rerun stops at the first round having a known invoice
+        self.server.order.insert(0, newest)
+        self.server.pdf_requests.clear()
+        self.assertEqual(client.download_invoices(download_path, incremental=True), 1)
+        self.assertEqual(sorted(self.server.pdf_requests), sorted(self.server.order[:2]))
+        self.assertEqual(len(Manifest(download_path)), 4)
+        self.assertEqual(len(list(download_path.glob("invoice_*.pdf"))), 4)
+        self.assertEqual(list(download_path.glob(".*.part")), [])
+
+        self.assertEqual(client.download_invoices(download_path, incremental=True), 0)
+
+    def test_failing_invoice_does_not_stop_the_others(self):
+        download_path = self.tmp_path / "invoices"
+        download_path.mkdir()
+        self.server.failing.add("90001")
+        client = InvoiceHttpClient(self.recorder("90000").discover(), concurrency=2, retries=0)
+
+        with self.assertRaises(ExceptionGroup) as raised:
+            client.download_invoices(download_path)
+        self.assertEqual(len(raised.exception.exceptions), 1)
+        self.assertEqual(len(Manifest(download_path)), 3)
+        self.assertEqual(len(list(download_path.glob("invoice_*.pdf"))), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from energylens.manifest import MANIFEST_NAME, Manifest
+
+sys.path.insert(0, (Path(__file__).parents[1] / "benchmarks").as_posix())
+from corpus import generate_corpus  # noqa: E402
+
+
+class ManifestMigrationTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.download_path = Path(tmp.name)
+        # Position named files of earlier versions, the same invoice twice as the list shifted
+        self.expected = generate_corpus(self.download_path, 2)
+        (self.download_path / "invoice_7.pdf").write_bytes((self.download_path / "invoice_00001.pdf").read_bytes())
+
+    def stable_names(self) -> list[str]:
+        return [f"invoice_{invoice['date']}_{invoice['invoice_number']}.pdf" for invoice in self.expected]
+
+    def test_position_named_files_are_renamed(self):
+        manifest = Manifest(self.download_path)
+        self.assertEqual(len(manifest), 2)
+        self.assertEqual(sorted(f.name for f in self.download_path.glob("*.pdf")), self.stable_names())
+        self.assertEqual(len(json.loads((self.download_path / MANIFEST_NAME).read_text())), 2)
+
+    def test_unreadable_files_are_skipped(self):
+        (self.download_path / "invoice_2.pdf").write_bytes(b"not a pdf")
+        manifest = Manifest(self.download_path)
+        self.assertEqual(len(manifest), 2)
+        self.assertTrue((self.download_path / "invoice_2.pdf").exists())
+        self.assertEqual(len(Manifest(self.download_path)), 2)
+        for name in self.stable_names():
+            self.assertTrue((self.download_path / name).exists())
+
+    def test_existing_manifest_is_not_migrated_again(self):
+        Manifest(self.download_path).save()
+        (self.download_path / "invoice_3.pdf").write_bytes(b"not a pdf")
+        self.assertEqual(len(Manifest(self.download_path)), 2)
+        self.assertTrue((self.download_path / "invoice_3.pdf").exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
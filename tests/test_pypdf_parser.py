@@ -0,0 +1,54 @@
+import math
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import polars as pl
+
+from energylens.pypdf_parser import FIELD_RULES, _pdf_to_text, _texts_to_pl, batch_texts_to_pl
+
+sys.path.insert(0, (Path(__file__).parents[1] / "benchmarks").as_posix())
+from corpus import LAYOUTS, generate_corpus  # noqa: E402
+
+# Columns without rules, never found in the text layer by the pypdf/regex method
+NAN_COLUMNS = [column for column, rule in FIELD_RULES.items() if not rule.patterns]
+
+
+class PypdfParserTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        tmp = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(tmp.cleanup)
+        corpus_path = Path(tmp.name)
+        cls.expected = generate_corpus(corpus_path, 20)
+        cls.texts = {invoice["filename"]: _pdf_to_text(corpus_path / invoice["filename"]) for invoice in cls.expected}
+
+    def test_nan_columns(self):
+        self.assertEqual(NAN_COLUMNS, ["Elhandel medelspotpris (öre/kWh)", "Elhandel fasta påslag (öre/kWh)"])
+
+    def test_rows_match_the_generated_values(self):
+        self.assertEqual({invoice["layout"] for invoice in self.expected}, set(LAYOUTS))
+        for invoice in self.expected:
+            row = _texts_to_pl(self.texts[invoice["filename"]]).row(0, named=True)
+            for column, value in invoice.items():
+                if column in ("filename", "layout"):
+                    continue
+                with self.subTest(filename=invoice["filename"], layout=invoice["layout"], column=column):
+                    if column in NAN_COLUMNS or value is None:
+                        self.assertTrue(math.isnan(row[column]))
+                    elif isinstance(value, float):
+                        self.assertAlmostEqual(row[column], value, places=2)
+                    else:
+                        self.assertEqual(row[column], value)
+
+    def test_batch_equals_rows_of_texts_to_pl(self):
+        texts = list(self.texts.values())
+        rows = pl.concat([_texts_to_pl(text_pages) for text_pages in texts])
+        batch = batch_texts_to_pl([" ".join(text_pages) for text_pages in texts])
+        self.assertEqual(batch.columns, rows.columns)
+        self.assertTrue(batch.equals(rows))
+
+
+if __name__ == "__main__":
+    unittest.main()
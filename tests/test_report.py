@@ -0,0 +1,63 @@
+import datetime
+import functools
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import polars as pl
+
+from energylens import report
+from energylens.dataset import upsert_dataset
+from energylens.pypdf_parser import parse_pdfs_to_pl_using_pypdf
+from energylens.schema import conform_to_schema
+
+sys.path.insert(0, (Path(__file__).parents[1] / "benchmarks").as_posix())
+from corpus import generate_corpus  # noqa: E402
+
+
+class InvoiceReportTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        tmp = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(tmp.cleanup)
+        cls.tmp_path = Path(tmp.name)
+        generate_corpus(cls.tmp_path / "corpus", 40)
+        invoices = conform_to_schema(parse_pdfs_to_pl_using_pypdf(sorted((cls.tmp_path / "corpus").glob("*.pdf"))))
+        cls.file = cls.tmp_path / "invoices.parquet"
+        invoices.write_parquet(cls.file)
+        cls.dataset = cls.tmp_path / "invoices.dataset"
+        upsert_dataset(invoices, cls.dataset)
+
+    def setUp(self):
+        cache_path = Path(tempfile.mkdtemp(dir=self.tmp_path))
+        patcher = mock.patch.object(report, "AggregateCache", functools.partial(report.AggregateCache, cache_path))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached_and_uncached_reports_are_equal(self):
+        # Mid-month bounds, the corpus has invoices after the end date within the end month
+        start, end = datetime.date(2019, 6, 15), datetime.date(2020, 3, 15)
+        for source in (self.file, self.dataset):
+            with self.subTest(source=source.name):
+                uncached = report.invoice_report(source, start=start, end=end, use_cache=False)
+                for _ in range(2):  # Filling and reading the cache
+                    cached = report.invoice_report(source, start=start, end=end, use_cache=True)
+                    self.assertTrue(cached.equals(uncached))
+                self.assertEqual(uncached["month"].min(), datetime.date(2019, 6, 1))
+                self.assertEqual(uncached["month"].max(), datetime.date(2020, 3, 1))
+
+    def test_file_and_dataset_reports_are_equal(self):
+        self.assertTrue(report.invoice_report(self.file).equals(report.invoice_report(self.dataset)))
+
+    def test_end_month_is_reported_in_full(self):
+        invoices = pl.read_parquet(self.file).filter(pl.col("date").dt.truncate("1mo") == datetime.date(2020, 3, 1))
+        march = report.invoice_report(self.file, end=datetime.date(2020, 3, 15), use_cache=False).filter(
+            pl.col("month") == datetime.date(2020, 3, 1)
+        )
+        self.assertEqual(march["invoices"].max(), invoices.height)
+
+
+if __name__ == "__main__":
+    unittest.main()